@@ -1,10 +1,23 @@
 import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
 import psycopg
 
 sys.path.append("/app")
 
-from ledger import canonical_payload, compute_block_hash, is_sha256_hex
+from ledger import canonical_payload, compute_block_digest, hash_text, is_sha256_digest
+
+# Backfill de payload_json en bloques INVENTORY_CREATE / INVOICE_CREATE.
+# Por chunks: lee con cursor de servidor (ledger JOIN inventory/invoices), verifica hashes en bloque
+# (opcionalmente en varios procesos), actualiza con un UPDATE set-based y hace commit por chunk junto
+# con un checkpoint, así que si se corta se retoma donde quedó.
+#
+# Uso: python backfill_payload.py [--restart]
+#   BACKFILL_CHUNK=5000    filas por chunk
+#   BACKFILL_WORKERS=1     procesos para recalcular hashes (>1 usa ProcessPoolExecutor)
 
 host = os.getenv("DB_HOST", "postgres")
 port = int(os.getenv("DB_PORT", "5432"))
@@ -13,82 +26,163 @@ user = os.getenv("DB_USER", "nexus")
 pwd  = os.getenv("DB_PASSWORD", "nexuspass")
 dsn = f"host={host} port={port} dbname={name} user={user} password={pwd}"
 
-updated = 0
-skipped = 0
-
-with psycopg.connect(dsn) as conn:
-    with conn.cursor() as cur:
-        cur.execute("""
-            SELECT id, ts, actor, action, tx_id, prev_hash, hash, payload_json
-            FROM ledger
-            WHERE action IN ('INVENTORY_CREATE','INVOICE_CREATE')
-            ORDER BY id;
-        """)
-        rows = cur.fetchall()
-
-        for (lid, ts, actor, action, tx_id, prev_hash, h, payload_json) in rows:
-            h = str(h)
-            payload_json = str(payload_json or "{}")
-
-            if not is_sha256_hex(h) or payload_json != "{}":
-                continue
-
-            if action == "INVENTORY_CREATE":
-                cur.execute("""
-                    SELECT id, date, item, category, type, qty, username
-                    FROM inventory
-                    WHERE hash = %s
-                    LIMIT 1;
-                """, (h,))
-                rec = cur.fetchone()
-                if not rec:
-                    skipped += 1
-                    continue
-
-                inv_id, date, item, category, typ, qty, username = rec
-                payload = {
-                    "inventory_id": int(inv_id),
-                    "date": date.isoformat(),
-                    "item": str(item),
-                    "category": str(category),
-                    "type": str(typ),
-                    "qty": int(qty),
-                    "user": str(username),
-                }
-
-            elif action == "INVOICE_CREATE":
-                cur.execute("""
-                    SELECT id, date, client, total, username
-                    FROM invoices
-                    WHERE hash = %s
-                    LIMIT 1;
-                """, (h,))
-                rec = cur.fetchone()
-                if not rec:
-                    skipped += 1
-                    continue
-
-                invc_id, date, client, total, username = rec
-                payload = {
-                    "invoice_id": int(invc_id),
-                    "date": date.isoformat(),
-                    "client": str(client),
-                    "total": float(total),
-                    "user": str(username),
-                }
-
-            else:
-                continue
-
-            pj = canonical_payload(payload)
-            expected = compute_block_hash(str(prev_hash), ts.isoformat(), str(actor), str(action), str(tx_id), pj)
-
-            if expected != h:
-                skipped += 1
-                continue
-
-            cur.execute("UPDATE ledger SET payload_json = %s WHERE id = %s;", (pj, lid))
-            updated += 1
-
-print(f"Backfill listo. updated={updated}, skipped={skipped}")
-
+CHUNK = int(os.getenv("BACKFILL_CHUNK", "5000"))
+WORKERS = int(os.getenv("BACKFILL_WORKERS", "1"))
+CHECKPOINT_NAME = "payload_json"
+
+# un LATERAL por tipo: cada bloque trae a lo sumo su registro de negocio (mismo hash)
+CANDIDATES_SQL = """
+    SELECT l.id, l.ts, l.actor, l.action, l.tx_id, l.prev_hash, l.hash,
+           inv.id, inv.date, inv.item, inv.category, inv.type, inv.qty, inv.username,
+           ic.id, ic.date, ic.client, ic.total, ic.username
+    FROM ledger l
+    LEFT JOIN LATERAL (
+        SELECT id, date, item, category, type, qty, username
+        FROM inventory
+        WHERE l.action = 'INVENTORY_CREATE' AND hash = l.hash
+        ORDER BY id
+        LIMIT 1
+    ) inv ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT id, date, client, total, username
+        FROM invoices
+        WHERE l.action = 'INVOICE_CREATE' AND hash = l.hash
+        ORDER BY id
+        LIMIT 1
+    ) ic ON TRUE
+    WHERE l.id > %s
+      AND l.action IN ('INVENTORY_CREATE','INVOICE_CREATE')
+      AND COALESCE(l.payload_json, '{}') = '{}'
+    ORDER BY l.id;
+"""
+
+
+def build_payload(row: tuple) -> Tuple[int, Optional[str]]:
+    # (ledger_id, payload_json) si el payload reconstruido reproduce el hash; None si no
+    (lid, ts, actor, action, tx_id, prev_hash, h,
+     inv_id, inv_date, item, category, typ, qty, inv_user,
+     invc_id, invc_date, client, total, invc_user) = row
+
+    h = bytes(h)
+    if not is_sha256_digest(h):
+        return lid, None
+
+    if action == "INVENTORY_CREATE" and inv_id is not None:
+        payload = {
+            "inventory_id": int(inv_id),
+            "date": inv_date.isoformat(),
+            "item": str(item),
+            "category": str(category),
+            "type": str(typ),
+            "qty": int(qty),
+            "user": str(inv_user),
+        }
+    elif action == "INVOICE_CREATE" and invc_id is not None:
+        payload = {
+            "invoice_id": int(invc_id),
+            "date": invc_date.isoformat(),
+            "client": str(client),
+            "total": float(total),
+            "user": str(invc_user),
+        }
+    else:
+        return lid, None
+
+    pj = canonical_payload(payload)
+    expected = compute_block_digest(hash_text(prev_hash), ts.isoformat(), str(actor), str(action), str(tx_id), pj)
+    return lid, (pj if expected == h else None)
+
+
+def verify_chunk(rows: List[tuple], pool: Optional[ProcessPoolExecutor]) -> List[Tuple[int, Optional[str]]]:
+    if pool is None:
+        return [build_payload(r) for r in rows]
+    return list(pool.map(build_payload, rows, chunksize=max(1, len(rows) // (WORKERS * 4))))
+
+
+def load_checkpoint(cur, restart: bool) -> int:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS backfill_checkpoint (
+          name       TEXT PRIMARY KEY,
+          last_id    INT NOT NULL,
+          updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """
+    )
+    if restart:
+        cur.execute("DELETE FROM backfill_checkpoint WHERE name = %s;", (CHECKPOINT_NAME,))
+        return 0
+    cur.execute("SELECT last_id FROM backfill_checkpoint WHERE name = %s;", (CHECKPOINT_NAME,))
+    row = cur.fetchone()
+    return int(row[0]) if row else 0
+
+
+def save_chunk(cur, results: List[Tuple[int, Optional[str]]], last_id: int) -> int:
+    ok = [(lid, pj) for lid, pj in results if pj is not None]
+    if ok:
+        cur.execute(
+            """
+            UPDATE ledger AS l SET payload_json = v.pj
+            FROM unnest(%s::int[], %s::text[]) AS v(id, pj)
+            WHERE l.id = v.id;
+            """,
+            ([lid for lid, _ in ok], [pj for _, pj in ok]),
+        )
+    cur.execute(
+        """
+        INSERT INTO backfill_checkpoint(name, last_id, updated_at) VALUES (%s, %s, now())
+        ON CONFLICT (name) DO UPDATE SET last_id = EXCLUDED.last_id, updated_at = EXCLUDED.updated_at;
+        """,
+        (CHECKPOINT_NAME, last_id),
+    )
+    return len(ok)
+
+
+def main() -> None:
+    restart = "--restart" in sys.argv
+    updated = 0
+    skipped = 0
+    processed = 0
+    started = time.perf_counter()
+    pool = ProcessPoolExecutor(max_workers=WORKERS) if WORKERS > 1 else None
+
+    # dos conexiones: lectura con cursor de servidor (una transacción larga, solo lectura)
+    # y escritura con commit por chunk
+    with psycopg.connect(dsn) as reader, psycopg.connect(dsn) as writer:
+        with writer.cursor() as wcur:
+            after = load_checkpoint(wcur, restart)
+            writer.commit()
+            if after:
+                print(f"Retomando desde ledger.id > {after}")
+
+            with reader.cursor(name="backfill_payload") as rcur:
+                rcur.itersize = CHUNK
+                rcur.execute(CANDIDATES_SQL, (after,))
+                while True:
+                    rows = rcur.fetchmany(CHUNK)
+                    if not rows:
+                        break
+
+                    results = verify_chunk(rows, pool)
+                    n_ok = save_chunk(wcur, results, int(rows[-1][0]))
+                    writer.commit()
+
+                    processed += len(rows)
+                    updated += n_ok
+                    skipped += len(rows) - n_ok
+                    elapsed = time.perf_counter() - started
+                    print(
+                        f"  hasta id={rows[-1][0]}: procesados={processed} updated={updated} "
+                        f"skipped={skipped} ({processed / elapsed:.0f} filas/s)"
+                    )
+
+    if pool is not None:
+        pool.shutdown()
+
+    elapsed = time.perf_counter() - started
+    rate = processed / elapsed if elapsed else 0.0
+    print(f"Backfill listo. updated={updated}, skipped={skipped}, {elapsed:.1f}s ({rate:.0f} filas/s)")
+
+
+if __name__ == "__main__":
+    main()
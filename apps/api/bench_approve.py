@@ -0,0 +1,121 @@
+import asyncio
+import os
+import time
+from typing import List, Tuple
+
+import psycopg
+from fastapi import HTTPException
+
+from db import dsn
+from main import APPROVE_SELECT_SQL, approval_error, approval_payload, approve_invoice, insert_ledger, make_tx_id
+
+# Benchmark de aprobaciones concurrentes, directo a Postgres (sin HTTP de por medio):
+#   secuencial  el flujo anterior de POST /admin/invoices/{id}/approve, una sentencia por viaje (~11 con el COMMIT)
+#   pipeline    approve_invoice de la API: dos viajes (lock + cola Merkle, y escritura + COMMIT)
+# Cada modo aprueba su propio juego de facturas con BENCH_CONCURRENCY conexiones; todas compiten por la cabeza
+# del ledger, así que cada viaje ahorrado es tiempo de lock menos para las demás.
+#
+# Uso (con las variables DB_* de la misma base que usa la API, ya migrada):
+#   BENCH_N=500 BENCH_CONCURRENCY=16 python bench_approve.py
+# Contra la base del cluster (kubectl port-forward) se ve además la latencia de red por viaje.
+#
+# Sub-cadenas: los lotes sembrados se reparten entre BENCH_CATEGORIES categorías; con LEDGER_CHAINS=N (la misma
+# variable de la API) cada categoría cae en una cabeza y las aprobaciones dejan de competir por una sola:
+#   LEDGER_CHAINS=1 BENCH_CATEGORIES=8 python bench_approve.py
+#   LEDGER_CHAINS=4 BENCH_CATEGORIES=8 python bench_approve.py
+
+n = int(os.getenv("BENCH_N", "500"))
+concurrency = int(os.getenv("BENCH_CONCURRENCY", "16"))
+categories = int(os.getenv("BENCH_CATEGORIES", "8"))
+
+SEED_SQL = """
+    WITH lots AS (
+        INSERT INTO inventory(date, item, category, type, qty, status, username, hash)
+        SELECT DATE '2024-01-01', 'Lote-BENCH-APPROVE-' || g, 'Cacao BENCH-' || (g %% %s), 'Entrada', 1,
+               'RESERVED', 'bodega', NULL
+        FROM generate_series(1, %s) AS g
+        RETURNING id
+    )
+    INSERT INTO invoices(inventory_id, date, client, total, status, username, hash)
+    SELECT id, DATE '2024-01-02', 'Bench', 1.0, 'PENDING_APPROVAL', 'oficina', NULL FROM lots
+    RETURNING id;
+"""
+
+
+async def approve_sequential(conn, invoice_id: int, role: str) -> bytes:
+    async with conn.cursor() as cur:
+        await cur.execute(APPROVE_SELECT_SQL + " WHERE i.id = %s FOR UPDATE OF i;", (invoice_id,))
+        row = await cur.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Factura no encontrada")
+        err = approval_error(row)
+        if err:
+            raise HTTPException(status_code=err[0], detail=err[1])
+        inv_id = row[1]
+        await cur.execute("UPDATE invoices SET status = 'APPROVED' WHERE id = %s;", (invoice_id,))
+        await cur.execute("UPDATE inventory SET status = 'SOLD' WHERE id = %s;", (inv_id,))
+        tx_id = make_tx_id("APPROVE", invoice_id)
+        block_hash = await insert_ledger(cur, role, "INVOICE_APPROVED", tx_id, approval_payload(row, role))
+        await cur.execute("UPDATE invoices SET hash = %s WHERE id = %s;", (block_hash, invoice_id))
+        await cur.execute("UPDATE inventory SET hash = %s WHERE id = %s;", (block_hash, inv_id))
+    await conn.commit()
+    return block_hash
+
+
+async def seed(count: int) -> List[int]:
+    async with await psycopg.AsyncConnection.connect(dsn()) as conn:
+        cur = await conn.execute(SEED_SQL, (max(1, categories), count))
+        return [int(r[0]) for r in await cur.fetchall()]
+
+
+async def run(label: str, approve, invoice_ids: List[int]) -> None:
+    queue: "asyncio.Queue[int]" = asyncio.Queue()
+    for invoice_id in invoice_ids:
+        queue.put_nowait(invoice_id)
+    samples: List[float] = []
+    errors = 0
+
+    async def worker() -> None:
+        nonlocal errors
+        async with await psycopg.AsyncConnection.connect(dsn()) as conn:
+            while not queue.empty():
+                invoice_id = queue.get_nowait()
+                t0 = time.perf_counter()
+                try:
+                    await approve(conn, invoice_id, "admin")
+                except HTTPException:
+                    await conn.rollback()
+                    errors += 1
+                    continue
+                samples.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    report(label, sorted(samples), time.perf_counter() - t0, errors)
+
+
+def percentile(sorted_ms: List[float], p: float) -> float:
+    if not sorted_ms:
+        return 0.0
+    k = max(0, min(len(sorted_ms) - 1, int(round(p / 100 * len(sorted_ms) + 0.5)) - 1))
+    return sorted_ms[k]
+
+
+def report(label: str, ms: List[float], seconds: float, errors: int) -> None:
+    print(
+        f"{label:<12} {len(ms):>7} {len(ms) / seconds:>9.1f} {percentile(ms, 50):>9.2f} "
+        f"{percentile(ms, 95):>9.2f} {percentile(ms, 99):>9.2f} {errors:>5}"
+    )
+
+
+async def main() -> None:
+    modes: List[Tuple[str, object]] = [("secuencial", approve_sequential), ("pipeline", approve_invoice)]
+    batches = [await seed(n) for _ in modes]
+    print(f"{n} aprobaciones por modo, {concurrency} conexiones concurrentes, {categories} categorías")
+    print(f"{'modo':<12} {'n':>7} {'aprob/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'err':>5}")
+    for (label, approve), invoice_ids in zip(modes, batches):
+        await run(label, approve, invoice_ids)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
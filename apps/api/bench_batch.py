@@ -0,0 +1,63 @@
+import json
+import os
+import time
+import urllib.request
+
+# Benchmark: endpoints unitarios vs batch (inventario + aprobación).
+# Uso: API_URL=http://localhost:8000 BENCH_N=200 python bench_batch.py
+
+api = os.getenv("API_URL", "http://localhost:8000").rstrip("/")
+n = int(os.getenv("BENCH_N", "200"))
+
+
+def call(method: str, path: str, body=None, token: str = ""):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(f"{api}{path}", data=data, method=method)
+    req.add_header("Content-Type", "application/json")
+    if token:
+        req.add_header("Authorization", f"Bearer {token}")
+    with urllib.request.urlopen(req) as res:
+        return json.loads(res.read() or b"null")
+
+
+def login(username: str) -> str:
+    return call("POST", "/auth/login", {"username": username, "password": ""})["token"]
+
+
+def lot(i: int) -> dict:
+    return {"date": "2024-01-01", "item": f"Lote-BENCH-{i:06d}", "category": "Cacao CCN-51", "type": "Entrada", "qty": 1}
+
+
+def invoices_for(lot_ids, token: str):
+    return [
+        call("POST", "/invoices", {"inventory_id": lid, "date": "2024-01-02", "client": "Bench", "total": 1.0}, token)["id"]
+        for lid in lot_ids
+    ]
+
+
+def report(label: str, count: int, seconds: float) -> None:
+    print(f"{label:<28} {count:>6} items  {seconds:8.3f}s  {count / seconds:10.1f} items/s")
+
+
+bodega, oficina, admin = login("bodega"), login("oficina"), login("admin")
+
+t0 = time.perf_counter()
+single_lots = [call("POST", "/inventory", lot(i), bodega)["id"] for i in range(n)]
+report("POST /inventory", n, time.perf_counter() - t0)
+
+t0 = time.perf_counter()
+res = call("POST", "/inventory/batch", {"items": [lot(n + i) for i in range(n)]}, bodega)
+batch_lots = [it["id"] for it in res["items"]]
+report("POST /inventory/batch", n, time.perf_counter() - t0)
+
+single_invoices = invoices_for(single_lots, oficina)
+batch_invoices = invoices_for(batch_lots, oficina)
+
+t0 = time.perf_counter()
+for invoice_id in single_invoices:
+    call("POST", f"/admin/invoices/{invoice_id}/approve", None, admin)
+report("POST .../{id}/approve", n, time.perf_counter() - t0)
+
+t0 = time.perf_counter()
+res = call("POST", "/admin/invoices/approve-batch", {"invoice_ids": batch_invoices}, admin)
+report("POST .../approve-batch", res["approved"], time.perf_counter() - t0)
@@ -0,0 +1,228 @@
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import psycopg
+
+from db import dsn
+from ledger import canonical_payload, compute_block_digest, hash_text, now_utc
+from main import lock_ledger_head, merkle_append_batch
+
+# Benchmark de carga: siembra el ledger a distintos tamaños y, para cada uno, corre una carga mixta
+# concurrente (bodega ingresa lotes, oficina factura, admin aprueba y audita) contra la API.
+# Reporta throughput y p50/p95/p99 por endpoint y la duración de GET /ledger/verify?full=true.
+#
+# Uso (con las variables DB_* de la misma base que usa la API):
+#   API_URL=http://localhost:8000 BENCH_SIZES=10000,100000 python bench_load.py
+#   python bench_load.py seed 1000000      # solo sembrar hasta 1M bloques
+#
+#   BENCH_SIZES=10000,100000,1000000,10000000   tamaños de ledger (la siembra solo completa lo que falta)
+#   BENCH_DURATION=30      segundos de carga por tamaño
+#   BENCH_CONCURRENCY=16   clientes concurrentes
+#   BENCH_MIX=bodega=3,oficina=3,admin=2,auditor=2   peso de cada rol en la carga
+#   BENCH_SEED_CHUNK=10000 bloques por transacción al sembrar
+
+api = os.getenv("API_URL", "http://localhost:8000").rstrip("/")
+sizes = [int(s) for s in os.getenv("BENCH_SIZES", "10000,100000").split(",") if s.strip()]
+duration = float(os.getenv("BENCH_DURATION", "30"))
+concurrency = int(os.getenv("BENCH_CONCURRENCY", "16"))
+mix = {k: float(v) for k, v in (p.split("=") for p in os.getenv("BENCH_MIX", "bodega=3,oficina=3,admin=2,auditor=2").split(","))}
+seed_chunk = int(os.getenv("BENCH_SEED_CHUNK", "10000"))
+
+# semilla fija: misma secuencia de roles/lotes en cada corrida
+rng = random.Random(int(os.getenv("BENCH_RANDOM_SEED", "42")))
+
+
+# -----------------------------
+# Siembra (directo a Postgres, mismo encadenamiento y Merkle que la API)
+# -----------------------------
+async def seed_to(total: int) -> int:
+    # completa el ledger hasta `total` bloques con bloques BENCH_SEED encadenados; devuelve cuántos agregó
+    added = 0
+    started = time.perf_counter()
+    async with await psycopg.AsyncConnection.connect(dsn()) as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT COUNT(*) FROM ledger;")
+            count = int((await cur.fetchone())[0])
+            await conn.commit()
+
+            while count < total:
+                n = min(seed_chunk, total - count)
+                # siempre en la cadena 0 (la de la historia): con LEDGER_CHAINS>1 la API escribe en las otras
+                prev_digest = await lock_ledger_head(cur, 0)
+                prev_hash = hash_text(prev_digest)
+                await cur.execute("SELECT last_id FROM ledger_head WHERE chain = 0;")
+                last_id = int((await cur.fetchone())[0])
+
+                async with cur.copy(
+                    "COPY ledger(ts, actor, action, tx_id, prev_hash, payload_json, hash) FROM STDIN"
+                ) as copy:
+                    for i in range(count, count + n):
+                        ts = now_utc()
+                        tx_id = f"TX_BENCH_{i:08d}"
+                        payload_json = canonical_payload({"n": i})
+                        digest = compute_block_digest(prev_hash, ts.isoformat(), "bench", "BENCH_SEED", tx_id, payload_json)
+                        await copy.write_row((ts, "bench", "BENCH_SEED", tx_id, prev_digest, payload_json, digest))
+                        prev_digest, prev_hash = digest, digest.hex()
+
+                # bajo el lock de cabeza nadie más inserta en la cadena 0: sus ids nuevos son exactamente los > last_id
+                await cur.execute("SELECT id, hash FROM ledger WHERE chain = 0 AND id > %s ORDER BY id;", (last_id,))
+                blocks = [(int(i), bytes(h)) for i, h in await cur.fetchall()]
+                await cur.execute(
+                    "UPDATE ledger_head SET last_id = %s, hash = %s, updated_at = now() WHERE chain = 0;",
+                    blocks[-1],
+                )
+                await merkle_append_batch(cur, 0, blocks)
+                await conn.commit()
+
+                count += n
+                added += n
+                elapsed = time.perf_counter() - started
+                print(f"  sembrados {count}/{total} ({added / elapsed:.0f} bloques/s)")
+    return added
+
+
+# -----------------------------
+# Cliente HTTP
+# -----------------------------
+def call(method: str, path: str, body=None, token: str = "") -> Tuple[int, object]:
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(f"{api}{path}", data=data, method=method)
+    req.add_header("Content-Type", "application/json")
+    if token:
+        req.add_header("Authorization", f"Bearer {token}")
+    try:
+        with urllib.request.urlopen(req) as res:
+            return res.status, json.loads(res.read() or b"null")
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code, None
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def timed(self, label: str, method: str, path: str, body=None, token: str = "") -> Tuple[int, object]:
+        t0 = time.perf_counter()
+        code, data = call(method, path, body, token)
+        ms = (time.perf_counter() - t0) * 1000
+        with self.lock:
+            self.samples.setdefault(label, []).append(ms)
+            # 409 en carga concurrente es esperado (otro cliente tomó el lote/factura primero)
+            if code >= 400 and code != 409:
+                self.errors[label] = self.errors.get(label, 0) + 1
+        return code, data
+
+
+def percentile(sorted_ms: List[float], p: float) -> float:
+    if not sorted_ms:
+        return 0.0
+    k = max(0, min(len(sorted_ms) - 1, int(round(p / 100 * len(sorted_ms) + 0.5)) - 1))
+    return sorted_ms[k]
+
+
+# -----------------------------
+# Carga mixta
+# -----------------------------
+def login(rec: Recorder, username: str) -> str:
+    _, data = rec.timed("POST /auth/login", "POST", "/auth/login", {"username": username, "password": ""})
+    return data["token"]  # type: ignore
+
+
+def bodega_op(rec: Recorder, tokens: Dict[str, str], i: int, ledger_size: int) -> None:
+    lot = {"date": "2024-01-01", "item": f"Lote-LOAD-{i:08d}", "category": "Cacao CCN-51", "type": "Entrada", "qty": 1}
+    rec.timed("POST /inventory", "POST", "/inventory", lot, tokens["bodega"])
+
+
+def oficina_op(rec: Recorder, tokens: Dict[str, str], i: int, ledger_size: int) -> None:
+    _, lots = rec.timed("GET /lots/available", "GET", "/lots/available?limit=50", None, tokens["oficina"])
+    if lots:
+        lot = rng.choice(lots)  # type: ignore
+        body = {"inventory_id": lot["id"], "date": "2024-01-02", "client": "Load", "total": 1.0}
+        rec.timed("POST /invoices", "POST", "/invoices", body, tokens["oficina"])
+
+
+def admin_op(rec: Recorder, tokens: Dict[str, str], i: int, ledger_size: int) -> None:
+    _, pending = rec.timed("GET /admin/pending", "GET", "/admin/pending", None, tokens["admin"])
+    if pending:
+        invoice = rng.choice(pending[:20])  # type: ignore
+        rec.timed("POST /admin/.../approve", "POST", f"/admin/invoices/{invoice['id']}/approve", None, tokens["admin"])
+
+
+def auditor_op(rec: Recorder, tokens: Dict[str, str], i: int, ledger_size: int) -> None:
+    # páginas en cualquier punto del ledger (keyset: el costo no debería depender de la posición)
+    after = rng.randrange(max(1, ledger_size))
+    rec.timed("GET /ledger", "GET", f"/ledger?limit=200&after={after}", None, tokens["admin"])
+    login(rec, rng.choice(["bodega", "oficina", "admin"]))
+
+
+OPS = {"bodega": bodega_op, "oficina": oficina_op, "admin": admin_op, "auditor": auditor_op}
+
+
+def run_workload(ledger_size: int) -> Recorder:
+    rec = Recorder()
+    tokens = {u: login(rec, u) for u in ("bodega", "oficina", "admin")}
+    roles = [r for r in mix if mix[r] > 0]
+    weights = [mix[r] for r in roles]
+    # plan pre-generado: la secuencia de operaciones no depende del scheduling de los hilos
+    plan = rng.choices(roles, weights=weights, k=1_000_000)
+    cursor = iter(range(len(plan)))
+    cursor_lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client() -> None:
+        while time.perf_counter() < deadline:
+            with cursor_lock:
+                i = next(cursor)
+            OPS[plan[i]](rec, tokens, i, ledger_size)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for f in [pool.submit(client) for _ in range(concurrency)]:
+            f.result()
+    return rec
+
+
+def report(size: int, rec: Recorder, seconds: float, verify_ms: float, verify_ok: bool) -> None:
+    print(f"\n== ledger={size} bloques, {concurrency} clientes, {seconds:.0f}s ==")
+    print(f"{'endpoint':<26} {'n':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'err':>5}")
+    for label in sorted(rec.samples):
+        ms = sorted(rec.samples[label])
+        print(
+            f"{label:<26} {len(ms):>7} {len(ms) / seconds:>9.1f} {percentile(ms, 50):>9.1f} "
+            f"{percentile(ms, 95):>9.1f} {percentile(ms, 99):>9.1f} {rec.errors.get(label, 0):>5}"
+        )
+    print(f"{'GET /ledger/verify?full':<26} {verify_ms / 1000:>8.2f}s  ok={verify_ok}")
+
+
+def bench(size: int) -> None:
+    asyncio.run(seed_to(size))
+
+    t0 = time.perf_counter()
+    rec = run_workload(size)
+    seconds = time.perf_counter() - t0
+
+    # verificación completa al final (sin carga): mide el barrido de toda la cadena
+    admin = call("POST", "/auth/login", {"username": "admin", "password": ""})[1]["token"]  # type: ignore
+    t0 = time.perf_counter()
+    _, res = call("GET", "/ledger/verify?full=true", None, admin)
+    verify_ms = (time.perf_counter() - t0) * 1000
+    report(size, rec, seconds, verify_ms, bool(res and res.get("ok")))  # type: ignore
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "seed":
+        print(f"Agregados: {asyncio.run(seed_to(int(sys.argv[2])))}")
+    else:
+        for size in sizes:
+            bench(size)
@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+import orjson
+import psycopg
+from fastapi.encoders import jsonable_encoder
+
+from db import dsn, note_write
+
+# Cache en proceso de listados calientes (/inventory, /lots/available, /admin/pending).
+# Cada tabla tiene una versión local; la clave de una entrada incluye la versión de las tablas de las que
+# depende, así que invalidar es solo incrementar la versión (las entradas viejas dejan de encontrarse y
+# salen por LRU). Los handlers que escriben invalidan después del commit.
+#
+# Con NEXUS_READ_CACHE_SHARED=1 cada réplica escucha el canal nexus_cache: los triggers de la migración 7
+# notifican el nombre de la tabla en cada escritura (también SQL directo), así que todas las réplicas invalidan.
+# El TTL es la red de seguridad si el listener se cae o el cache no es compartido con varias réplicas.
+READ_CACHE_SIZE = int(os.getenv("NEXUS_READ_CACHE_SIZE", "256"))
+READ_CACHE_TTL = float(os.getenv("NEXUS_READ_CACHE_TTL", "30"))
+READ_CACHE_SHARED = os.getenv("NEXUS_READ_CACHE_SHARED", "0") == "1"
+NOTIFY_CHANNEL = "nexus_cache"
+
+CachedBody = Tuple[float, bytes, str, Optional[str]]  # (expira, json, etag, X-Next-After)
+
+_versions: Dict[str, int] = {}
+_entries: "OrderedDict[Tuple[Any, ...], CachedBody]" = OrderedDict()
+_listener: Optional[asyncio.Task] = None
+
+
+def invalidate(*tables: str) -> None:
+    for table in tables:
+        _versions[table] = _versions.get(table, 0) + 1
+    # cada invalidación sigue a un commit: las cargas del cache no leen réplicas atrasadas respecto de él
+    note_write()
+
+
+def invalidate_all() -> None:
+    # "*" forma parte de todas las claves
+    invalidate("*")
+
+
+def _key(name: str, tables: Iterable[str], params: Tuple[Any, ...]) -> Tuple[Any, ...]:
+    return (name, params, tuple(_versions.get(t, 0) for t in ("*", *tables)))
+
+
+def encode(rows: Any) -> Tuple[bytes, str]:
+    # orjson (tipos que no conoce pasan por jsonable_encoder); el ETag sale del contenido, no de la versión:
+    # 304 solo si el cuerpo es realmente el mismo (aunque haya expirado el TTL)
+    body = orjson.dumps(rows, default=jsonable_encoder)
+    return body, '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+async def cached(
+    name: str,
+    tables: Iterable[str],
+    params: Tuple[Any, ...],
+    load: Callable[[], Awaitable[Tuple[Any, Optional[str]]]],
+) -> CachedBody:
+    # load() -> (filas serializables, X-Next-After); solo se llama si no hay entrada vigente
+    tables = tuple(tables)
+    key = _key(name, tables, params)
+    hit = _entries.get(key)
+    if hit is not None and hit[0] > time.monotonic():
+        _entries.move_to_end(key)
+        return hit
+
+    # la clave se calculó antes de consultar: si alguien escribe mientras tanto, esta entrada
+    # queda bajo la versión vieja y nunca se sirve
+    rows, next_after = await load()
+    body, etag = encode(rows)
+    entry: CachedBody = (time.monotonic() + READ_CACHE_TTL, body, etag, next_after)
+    _entries[key] = entry
+    if len(_entries) > READ_CACHE_SIZE:
+        _entries.popitem(last=False)
+    return entry
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [t.strip() for t in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+# -----------------------------
+# Invalidación compartida (LISTEN/NOTIFY)
+# -----------------------------
+async def _listen() -> None:
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(dsn(), autocommit=True) as conn:
+                await conn.execute(f"LISTEN {NOTIFY_CHANNEL};")
+                # al (re)conectar pudo perderse algo: invalidar todo
+                invalidate_all()
+                async for notify in conn.notifies():
+                    invalidate(notify.payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await asyncio.sleep(1.0)
+
+
+def start_listener() -> None:
+    global _listener
+    if READ_CACHE_SHARED and _listener is None:
+        _listener = asyncio.get_running_loop().create_task(_listen())
+
+
+async def stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+        _listener = None
@@ -1,33 +1,419 @@
+import asyncio
+import itertools
 import os
-from typing import Any, Dict, List, Optional, Tuple
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional, Tuple
 
 import psycopg
+from psycopg.types.numeric import FloatLoader
+from psycopg.types.string import ByteaLoader
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
 
+from ledger import hash_text
+from metrics import DB_QUERY_SECONDS, DB_READS, query_label, timed
 
-def dsn() -> str:
+# Pool compartido: min/max acotados para dimensionarlo contra max_connections de Postgres
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "3600"))
+
+# Réplicas de lectura (opcional): DB_REPLICA_HOSTS="host[:puerto],..." con la misma base/usuario/clave que la
+# primaria. Cada réplica tiene su pool; un monitor compara su LSN reproducido con el de la primaria y la saca de la
+# rotación si no responde o si lleva más de DB_REPLICA_MAX_LAG segundos sin alcanzarla. Sin réplicas sanas, las
+# lecturas van a la primaria.
+REPLICA_HOSTS = [h.strip() for h in os.getenv("DB_REPLICA_HOSTS", "").split(",") if h.strip()]
+REPLICA_POOL_MAX_SIZE = int(os.getenv("DB_REPLICA_POOL_MAX_SIZE", str(POOL_MAX_SIZE)))
+REPLICA_TIMEOUT = float(os.getenv("DB_REPLICA_TIMEOUT", "1"))
+REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "1"))
+REPLICA_CHECK_MIN_GAP = 0.05  # tras una escritura el monitor re-chequea enseguida, pero no más de 20 veces/s
+
+# a dónde puede ir una lectura:
+#   primary  siempre la primaria (escrituras, o lecturas que deben ver lo recién escrito en la misma transacción)
+#   replica  cualquier réplica sana (atraso acotado por DB_REPLICA_MAX_LAG)
+#   fresh    una réplica que ya reprodujo todas las escrituras conocidas por este proceso y las del cliente
+#            (read-your-writes); es lo que usan los listados cacheados, que si no guardarían una foto vieja bajo
+#            la versión nueva
+Route = Literal["primary", "replica", "fresh"]
+
+REPLICA_STATUS_SQL = """
+    SELECT pg_is_in_recovery(), COALESCE(pg_last_wal_replay_lsn() >= %s::pg_lsn, false),
+           pg_last_wal_replay_lsn()::text;
+"""
+
+# Read-your-writes entre procesos: el contador de escrituras es por proceso, y el request siguiente del cliente
+# puede caer en otro worker/pod. Tras una escritura la respuesta lleva el LSN de la primaria (header X-Nexus-LSN
+# y cookie nexus_lsn); el cliente lo devuelve y sus lecturas "fresh" solo van a una réplica que ya lo reprodujo.
+# La cookie vive lo que tarda una réplica en rotación en alcanzar ese punto (atraso + un chequeo del monitor)
+LSN_HEADER = "x-nexus-lsn"
+LSN_COOKIE = "nexus_lsn"
+LSN_COOKIE_MAX_AGE = int(REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL) + 1
+
+_pool: Optional[AsyncConnectionPool] = None
+
+
+def dsn(host_port: Optional[str] = None) -> str:
     host = os.getenv("DB_HOST", "postgres")
     port = int(os.getenv("DB_PORT", "5432"))
+    if host_port:
+        host, _, replica_port = host_port.partition(":")
+        port = int(replica_port or port)
     name = os.getenv("DB_NAME", "nexusdb")
     user = os.getenv("DB_USER", "nexus")
     pwd = os.getenv("DB_PASSWORD", "nexuspass")
     return f"host={host} port={port} dbname={name} user={user} password={pwd}"
 
 
-def fetch_one(sql: str, params: Tuple[Any, ...] = ()) -> Optional[Dict[str, Any]]:
-    with psycopg.connect(dsn()) as conn:
-        with conn.cursor() as cur:
-            cur.execute(sql, params)
-            row = cur.fetchone()
+def get_pool() -> AsyncConnectionPool:
+    global _pool
+    if _pool is None:
+        _pool = AsyncConnectionPool(
+            dsn(),
+            min_size=POOL_MIN_SIZE,
+            max_size=POOL_MAX_SIZE,
+            timeout=POOL_TIMEOUT,
+            max_idle=POOL_MAX_IDLE,
+            max_lifetime=POOL_MAX_LIFETIME,
+            # health check al prestar la conexión (descarta conexiones muertas)
+            check=AsyncConnectionPool.check_connection,
+            name="nexus",
+            # el pool async se abre dentro del event loop (open_pool en el startup)
+            open=False,
+        )
+    return _pool
+
+
+class Replica:
+    def __init__(self, host_port: str) -> None:
+        self.host = host_port
+        self.pool = AsyncConnectionPool(
+            dsn(host_port),
+            min_size=POOL_MIN_SIZE,
+            max_size=REPLICA_POOL_MAX_SIZE,
+            timeout=REPLICA_TIMEOUT,
+            max_idle=POOL_MAX_IDLE,
+            max_lifetime=POOL_MAX_LIFETIME,
+            check=AsyncConnectionPool.check_connection,
+            name=f"nexus-replica-{host_port}",
+            open=False,
+        )
+        self.healthy = False
+        self.caught_up_at: Optional[float] = None  # monotonic del último chequeo en que alcanzó a la primaria
+        self.fresh_seq = -1  # última escritura de este proceso que la réplica ya reprodujo
+        self.replay_lsn = 0  # LSN reproducido en el último chequeo (ver parse_lsn)
+
+    def lag(self) -> Optional[float]:
+        return None if self.caught_up_at is None else time.monotonic() - self.caught_up_at
+
+    def mark_down(self) -> None:
+        self.healthy = False
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.pool.get_stats()
+        lag = self.lag()
+        return {
+            "host": self.host,
+            "healthy": self.healthy,
+            "lag_seconds": round(lag, 3) if lag is not None else None,
+            "pool_size": int(stats.get("pool_size", 0)),
+            "pool_available": int(stats.get("pool_available", 0)),
+        }
+
+
+_replicas: List[Replica] = []
+_rotation = itertools.count()
+_write_seq = 0
+_write_event: Optional[asyncio.Event] = None
+_monitor: Optional[asyncio.Task] = None
+
+# LSN del cliente y si el request escribió: el middleware crea el holder, note_write y pick_replica lo usan
+_request_lsn: ContextVar[Optional[Dict[str, Any]]] = ContextVar("nexus_request_lsn", default=None)
+
+
+def parse_lsn(text: Optional[str]) -> Optional[int]:
+    # "16/B374D848" -> entero comparable; None si no es un LSN
+    hi, sep, lo = (text or "").strip().partition("/")
+    try:
+        return (int(hi, 16) << 32) | int(lo, 16) if sep else None
+    except ValueError:
+        return None
+
+
+def note_write() -> None:
+    # llamado después de cada commit que escribe (ver cache.invalidate): las lecturas "fresh" vuelven a la
+    # primaria hasta que el monitor confirme que una réplica reprodujo este punto
+    global _write_seq
+    _write_seq += 1
+    holder = _request_lsn.get()
+    if holder is not None:
+        holder["wrote"] = True
+    if _write_event is not None:
+        _write_event.set()
+
+
+def pick_replica(route: Route) -> Optional[Replica]:
+    if route == "primary" or not _replicas:
+        return None
+    holder = _request_lsn.get()
+    client_lsn = holder["lsn"] if holder is not None else 0
+    healthy = [
+        r
+        for r in _replicas
+        if r.healthy and (route == "replica" or (r.fresh_seq >= _write_seq and r.replay_lsn >= client_lsn))
+    ]
+    if not healthy:
+        return None
+    return healthy[next(_rotation) % len(healthy)]
+
+
+async def _check_replica(replica: Replica, primary_lsn: str, seq: int) -> None:
+    try:
+        async with replica.pool.connection(timeout=REPLICA_TIMEOUT) as conn:
+            cur = await conn.execute(REPLICA_STATUS_SQL, (primary_lsn,))
+            in_recovery, caught_up, replay_lsn = await cur.fetchone()
+    except Exception:
+        replica.mark_down()
+        return
+    if not in_recovery:
+        # promovida o mal configurada: ya no sigue a la primaria, sus lecturas podrían divergir
+        replica.mark_down()
+        return
+    replica.replay_lsn = max(replica.replay_lsn, parse_lsn(replay_lsn) or 0)
+    if caught_up:
+        replica.caught_up_at = time.monotonic()
+        replica.fresh_seq = max(replica.fresh_seq, seq)
+    lag = replica.lag()
+    replica.healthy = lag is not None and lag <= REPLICA_MAX_LAG
+
+
+async def _monitor_replicas() -> None:
+    while True:
+        try:
+            _write_event.clear()  # type: ignore
+            # seq antes del LSN: toda escritura con número <= seq ya commiteó cuando se lee el LSN de la primaria
+            seq = _write_seq
+            primary_lsn = await current_lsn()
+            await asyncio.gather(*(_check_replica(r, primary_lsn, seq) for r in _replicas))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # sin primaria no hay contra qué medir: las réplicas conservan su último estado
+            pass
+        await asyncio.sleep(REPLICA_CHECK_MIN_GAP)
+        try:
+            await asyncio.wait_for(_write_event.wait(), REPLICA_CHECK_INTERVAL)  # type: ignore
+        except asyncio.TimeoutError:
+            pass
+
+
+async def current_lsn() -> str:
+    async with connection() as conn:
+        cur = await conn.execute("SELECT pg_current_wal_lsn()::text;")
+        return (await cur.fetchone())[0]
+
+
+class ReadYourWritesMiddleware:
+    # ASGI puro, como MetricsMiddleware. Sin réplicas no hace nada: todo se lee de la primaria
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not REPLICA_HOSTS:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        lsn = parse_lsn(headers.get(LSN_HEADER.encode(), b"").decode("latin-1"))
+        if lsn is None:
+            for part in headers.get(b"cookie", b"").decode("latin-1").split(";"):
+                name, _, value = part.strip().partition("=")
+                if name == LSN_COOKIE:
+                    lsn = parse_lsn(value)
+        holder: Dict[str, Any] = {"lsn": lsn or 0, "wrote": False}
+        token = _request_lsn.set(holder)
+
+        async def send_with_lsn(message) -> None:
+            # el endpoint ya commiteó (note_write va después del commit): el LSN actual lo incluye
+            if message["type"] == "http.response.start" and holder["wrote"]:
+                try:
+                    written = await current_lsn()
+                except Exception:
+                    written = None
+                if written:
+                    cookie = f"{LSN_COOKIE}={written}; Max-Age={LSN_COOKIE_MAX_AGE}; Path=/; HttpOnly; SameSite=Lax"
+                    message = {
+                        **message,
+                        "headers": [
+                            *message.get("headers", []),
+                            (LSN_HEADER.encode(), written.encode()),
+                            (b"set-cookie", cookie.encode()),
+                        ],
+                    }
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_lsn)
+        finally:
+            _request_lsn.reset(token)
+
+
+async def open_pool() -> None:
+    global _write_event, _monitor
+    pool = get_pool()
+    await pool.open()
+    await pool.wait()
+    if REPLICA_HOSTS and not _replicas:
+        # sin wait: una réplica caída al arrancar no frena la API, el monitor la incorpora cuando responda
+        _replicas.extend(Replica(h) for h in REPLICA_HOSTS)
+        for replica in _replicas:
+            await replica.pool.open()
+        _write_event = asyncio.Event()
+        _monitor = asyncio.get_running_loop().create_task(_monitor_replicas())
+
+
+async def close_pool() -> None:
+    global _pool, _monitor
+    if _monitor is not None:
+        _monitor.cancel()
+        try:
+            await _monitor
+        except asyncio.CancelledError:
+            pass
+        _monitor = None
+    for replica in _replicas:
+        await replica.pool.close()
+    _replicas.clear()
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+@asynccontextmanager
+async def connection() -> AsyncIterator[psycopg.AsyncConnection]:
+    # commit al salir sin error, rollback si hay excepción (igual que psycopg.connect)
+    async with get_pool().connection() as conn:
+        yield conn
+
+
+@asynccontextmanager
+async def read_connection(route: Route = "replica") -> AsyncIterator[psycopg.AsyncConnection]:
+    # solo lectura: una réplica según `route`, o la primaria si no hay ninguna sana o no entrega conexión a tiempo
+    async with AsyncExitStack() as stack:
+        conn: Optional[psycopg.AsyncConnection] = None
+        replica = pick_replica(route)
+        if replica is not None:
+            try:
+                conn = await stack.enter_async_context(replica.pool.connection(timeout=REPLICA_TIMEOUT))
+            except (PoolTimeout, psycopg.OperationalError):
+                replica.mark_down()
+        DB_READS.labels("primary" if conn is None else "replica").inc()
+        if conn is None:
+            conn = await stack.enter_async_context(connection())
+        yield conn
+
+
+async def _read(route: Route, run):
+    # run(conn) -> resultado; si la réplica se cae a mitad de la consulta, se reintenta en la primaria
+    replica = pick_replica(route)
+    if replica is not None:
+        try:
+            async with replica.pool.connection(timeout=REPLICA_TIMEOUT) as conn:
+                result = await run(conn)
+            DB_READS.labels("replica").inc()
+            return result
+        except (PoolTimeout, psycopg.OperationalError):
+            replica.mark_down()
+    DB_READS.labels("primary").inc()
+    async with connection() as conn:
+        return await run(conn)
+
+
+def pool_stats() -> Dict[str, Any]:
+    stats = get_pool().get_stats()
+    size = int(stats.get("pool_size", 0))
+    available = int(stats.get("pool_available", 0))
+    in_use = size - available
+    requests = int(stats.get("requests_num", 0))
+    wait_ms = int(stats.get("requests_wait_ms", 0))
+    return {
+        **stats,
+        "in_use": in_use,
+        "saturation": round(in_use / POOL_MAX_SIZE, 3) if POOL_MAX_SIZE else 0.0,
+        "avg_wait_ms": round(wait_ms / requests, 3) if requests else 0.0,
+        "replicas": [r.stats() for r in _replicas],
+    }
+
+
+async def fetch_one(sql: str, params: Tuple[Any, ...] = (), route: Route = "primary") -> Optional[Dict[str, Any]]:
+    async def run(conn: psycopg.AsyncConnection) -> Optional[Dict[str, Any]]:
+        async with conn.cursor() as cur:
+            with timed(DB_QUERY_SECONDS, helper="fetch_one", query=query_label(sql)):
+                await cur.execute(sql, params)
+                row = await cur.fetchone()
             if not row:
                 return None
             cols = [d.name for d in cur.description]
             return dict(zip(cols, row))
 
+    return await _read(route, run)
+
 
-def fetch_all(sql: str, params: Tuple[Any, ...] = ()) -> List[Dict[str, Any]]:
-    with psycopg.connect(dsn()) as conn:
-        with conn.cursor() as cur:
-            cur.execute(sql, params)
-            rows = cur.fetchall()
+async def fetch_all(sql: str, params: Tuple[Any, ...] = (), route: Route = "primary") -> List[Dict[str, Any]]:
+    async def run(conn: psycopg.AsyncConnection) -> List[Dict[str, Any]]:
+        async with conn.cursor() as cur:
+            with timed(DB_QUERY_SECONDS, helper="fetch_all", query=query_label(sql)):
+                await cur.execute(sql, params)
+                rows = await cur.fetchall()
             cols = [d.name for d in cur.description]
-            return [dict(zip(cols, r)) for r in rows]
\ No newline at end of file
+            return [dict(zip(cols, r)) for r in rows]
+
+    return await _read(route, run)
+
+
+# columnas + filas como tuplas, ya convertidas: columnar las serializa tal cual; rows arma un dict por fila
+Table = Tuple[List[str], List[Tuple[Any, ...]]]
+
+
+class HashTextLoader(ByteaLoader):
+    # BYTEA llega en formato texto como "\x<hex>": un sha256 ya viene en hex, sin pasar por bytes
+    def load(self, data: Any) -> Optional[str]:
+        raw = bytes(data)
+        if len(raw) == 66 and raw[:2] == b"\\x":
+            return raw[2:].decode("ascii")
+        # rótulos legados (genesis) o bytea_output=escape
+        return hash_text(super().load(raw))
+
+
+async def fetch_table(sql: str, params: Tuple[Any, ...] = (), route: Route = "primary") -> Table:
+    # para listados grandes: hashes (BYTEA) como texto y NUMERIC como float ya al leer, en los loaders del cursor
+    async def run(conn: psycopg.AsyncConnection) -> Table:
+        async with conn.cursor() as cur:
+            cur.adapters.register_loader("bytea", HashTextLoader)
+            cur.adapters.register_loader("numeric", FloatLoader)
+            with timed(DB_QUERY_SECONDS, helper="fetch_table", query=query_label(sql)):
+                await cur.execute(sql, params)
+                rows = await cur.fetchall()
+            return [d.name for d in cur.description], rows
+
+    return await _read(route, run)
+
+
+async def stream_all(
+    sql: str, params: Tuple[Any, ...] = (), itersize: int = 2000, route: Route = "primary"
+) -> AsyncIterator[Dict[str, Any]]:
+    # cursor de servidor: memoria constante sin importar el tamaño del resultado
+    async with read_connection(route) as conn:
+        async with conn.cursor(name="nexus_stream") as cur:
+            cur.itersize = itersize
+            # solo el DECLARE: el recorrido depende del ritmo del cliente
+            with timed(DB_QUERY_SECONDS, helper="stream_all", query=query_label(sql)):
+                await cur.execute(sql, params)
+            cols: Optional[List[str]] = None
+            async for row in cur:
+                if cols is None:
+                    cols = [d.name for d in cur.description]
+                yield dict(zip(cols, row))
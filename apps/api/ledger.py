@@ -3,7 +3,7 @@ from __future__ import annotations
 import hashlib
 import json
 from datetime import datetime, timezone
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 
 def canonical_payload(payload: Dict[str, Any]) -> str:
@@ -15,6 +15,19 @@ def now_utc() -> datetime:
     return datetime.now(timezone.utc)
 
 
+def compute_block_digest(
+    prev_hash: str,
+    ts_iso: str,
+    actor: str,
+    action: str,
+    tx_id: str,
+    payload_json: str,
+) -> bytes:
+    # digest crudo (32 bytes), como se guarda en la DB; prev_hash entra en texto (hex) al mensaje
+    msg = f"{prev_hash}|{ts_iso}|{actor}|{action}|{tx_id}|{payload_json}"
+    return hashlib.sha256(msg.encode("utf-8")).digest()
+
+
 def compute_block_hash(
     prev_hash: str,
     ts_iso: str,
@@ -23,8 +36,37 @@ def compute_block_hash(
     tx_id: str,
     payload_json: str,
 ) -> str:
-    msg = f"{prev_hash}|{ts_iso}|{actor}|{action}|{tx_id}|{payload_json}"
-    return hashlib.sha256(msg.encode("utf-8")).hexdigest()
+    return compute_block_digest(prev_hash, ts_iso, actor, action, tx_id, payload_json).hex()
+
+
+# -----------------------------
+# Sub-cadenas
+# -----------------------------
+# Cadena 0: la histórica y las anclas. Con LEDGER_CHAINS=N > 1 los bloques nuevos van a las sub-cadenas 1..N
+# (cada una con su cabeza: los appends de distintas sub-cadenas no se esperan entre sí) y cada tanto un bloque
+# ancla en la cadena 0 fija las cabezas de todas.
+ANCHOR_ACTION = "LEDGER_ANCHOR"
+
+
+def chain_for(key: Optional[str], chains: int) -> int:
+    # sub-cadena de una clave (categoría del lote): estable entre procesos y réplicas.
+    # Espejo exacto de ledger_chain_for() en SQL (migración 13): md5 de la clave, primeros 32 bits
+    if chains <= 1:
+        return 0
+    return 1 + int(hashlib.md5((key or "").encode("utf-8")).hexdigest()[:8], 16) % chains
+
+
+def chain_genesis(chain: int) -> Optional[bytes]:
+    # prev_hash del primer bloque de una sub-cadena: depende del número, así un bloque movido de sub-cadena
+    # no enlaza. La cadena 0 arranca del genesis legado, que no se valida (None)
+    if chain == 0:
+        return None
+    return hashlib.sha256(f"NEXUS_CHAIN_{chain}".encode("utf-8")).digest()
+
+
+def anchor_payload(heads: Dict[int, Tuple[int, bytes]]) -> Dict[str, Any]:
+    # cabezas de las sub-cadenas al momento del ancla: {"heads": {"<chain>": {"id", "hash"}}}
+    return {"heads": {str(chain): {"id": last_id, "hash": h.hex()} for chain, (last_id, h) in sorted(heads.items())}}
 
 
 def make_tx_id(prefix: str, numeric_id: int) -> str:
@@ -45,3 +87,94 @@ def is_sha256_hex(s: str) -> bool:
     except ValueError:
         return False
 
+
+# Hashes en la DB: BYTEA de 32 bytes (NULL = pendiente). Los rótulos legados del genesis
+# ("INIT_HASH_GENESIS_BLOCK_SECURE", "0000000000000000") se guardan como sus bytes UTF-8.
+def hash_bytes(s: str) -> bytes:
+    s = normalize_hash(s)
+    return bytes.fromhex(s) if is_sha256_hex(s) else s.encode("utf-8")
+
+
+def hash_text(b: Optional[bytes]) -> Optional[str]:
+    # bytes -> texto de la API (y del mensaje hasheado): hex si es un sha256, rótulo legado si no
+    if b is None:
+        return None
+    b = bytes(b)
+    return b.hex() if len(b) == 32 else b.decode("utf-8")
+
+
+def is_sha256_digest(b: Optional[bytes]) -> bool:
+    return b is not None and len(b) == 32
+
+
+# -----------------------------
+# Merkle (RFC 6962) por segmentos del ledger
+# -----------------------------
+# frontier = picos de subárboles completos [(nivel, hash), ...] de mayor a menor;
+# permite agregar hojas en O(log n) sin releer el segmento.
+Frontier = List[Tuple[int, str]]
+
+
+def merkle_leaf(block_hash: str) -> str:
+    return hashlib.sha256(b"\x00" + block_hash.encode("utf-8")).hexdigest()
+
+
+def merkle_node(left: str, right: str) -> str:
+    return hashlib.sha256(b"\x01" + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def frontier_append(frontier: Frontier, leaf: str) -> Frontier:
+    out = list(frontier)
+    level, node = 0, leaf
+    while out and out[-1][0] == level:
+        _, left = out.pop()
+        node = merkle_node(left, node)
+        level += 1
+    out.append((level, node))
+    return out
+
+
+def frontier_root(frontier: Frontier) -> str:
+    if not frontier:
+        return hashlib.sha256(b"").hexdigest()
+    acc = frontier[-1][1]
+    for _, peak in reversed(frontier[:-1]):
+        acc = merkle_node(peak, acc)
+    return acc
+
+
+def _split(n: int) -> int:
+    # mayor potencia de 2 estrictamente menor que n
+    k = 1
+    while k * 2 < n:
+        k *= 2
+    return k
+
+
+def merkle_root(leaves: List[str]) -> str:
+    if not leaves:
+        return hashlib.sha256(b"").hexdigest()
+    if len(leaves) == 1:
+        return leaves[0]
+    k = _split(len(leaves))
+    return merkle_node(merkle_root(leaves[:k]), merkle_root(leaves[k:]))
+
+
+def merkle_proof(leaves: List[str], index: int) -> List[Dict[str, str]]:
+    # camino de auditoría de la hoja hacia la raíz: [{side, hash}], side = lado del hermano
+    if len(leaves) <= 1:
+        return []
+    k = _split(len(leaves))
+    if index < k:
+        return merkle_proof(leaves[:k], index) + [{"side": "right", "hash": merkle_root(leaves[k:])}]
+    return merkle_proof(leaves[k:], index - k) + [{"side": "left", "hash": merkle_root(leaves[:k])}]
+
+
+def verify_merkle_proof(block_hash: str, proof: List[Dict[str, str]], root: str) -> bool:
+    acc = merkle_leaf(block_hash)
+    for step in proof:
+        if step["side"] == "left":
+            acc = merkle_node(step["hash"], acc)
+        else:
+            acc = merkle_node(acc, step["hash"])
+    return acc == root
@@ -0,0 +1,339 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from ledger import ANCHOR_ACTION, chain_genesis, compute_block_digest, hash_text
+
+# Snapshot binario del ledger para auditoría offline: export lee la tabla con un cursor de servidor
+# y escribe un archivo de layout fijo; verify lo mapea en memoria (mmap) y re-hashea los bloques en un
+# pool de procesos (cada worker un rango de registros), y luego empalma los bordes prev_hash entre rangos,
+# por sub-cadena. Al final valida las anclas de la cadena 0 contra los bloques del propio snapshot.
+# La memoria no depende del tamaño del ledger: el sistema pagina el archivo a demanda.
+#
+# Uso:
+#   python ledger_snapshot.py export ledger.snap    # necesita las variables DB_* (como la API)
+#   python ledger_snapshot.py verify ledger.snap    # sin base de datos
+#   SNAPSHOT_WORKERS=<cpus>   procesos de verify
+#   SNAPSHOT_CHUNK=10000      filas por fetch en export
+#
+# Layout (little-endian):
+#   header  HEADER (magic, versión, tamaño de registro, cantidad de bloques, offset del heap)
+#   índice  count registros RECORD, ordenados por id
+#   heap    actor|action|tx_id|payload_json en UTF-8, contiguos, apuntados por heap_off + largos
+#   semillas (versión 3) una SEED por cadena que arranca después de particiones desacopladas, y FOOTER con
+#           la cantidad al final del archivo
+# Los hashes van crudos (32 bytes). Las etiquetas no-sha256 del genesis sembrado se guardan con sus bytes
+# UTF-8 rellenos con ceros y se marcan en flags. La versión 2 guarda la sub-cadena en dos bytes que en la 1
+# eran relleno (en cero): un snapshot versión 1 se lee igual, todo en la cadena 0. Sin semillas (versiones 1 y 2)
+# cada cadena enlaza con su genesis.
+
+MAGIC = b"NXLEDGR1"
+VERSION = 3
+VERSIONS = (1, 2, 3)
+HEADER = struct.Struct("<8sIIQQ")
+RECORD = struct.Struct("<qq32s32sBxHIIIIQ")  # id, ts (µs UTC), prev_hash, hash, flags, chain, largos x4, heap_off
+SEED = struct.Struct("<H32s")  # chain, hash con el que enlaza su primer bloque (último del sello desacoplado)
+FOOTER = struct.Struct("<I")  # cantidad de SEED
+FLAG_PREV_LABEL = 1
+FLAG_HASH_LABEL = 2
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+WORKERS = int(os.getenv("SNAPSHOT_WORKERS", str(os.cpu_count() or 1)))
+CHUNK = int(os.getenv("SNAPSHOT_CHUNK", "10000"))
+
+SNAPSHOT_SQL = """
+    SELECT id, ts, actor, action, tx_id, prev_hash, COALESCE(NULLIF(payload_json, ''), '{}'), hash, chain
+    FROM ledger
+    ORDER BY id;
+"""
+
+# mismo criterio que main.chain_start: si las particiones del principio de una cadena se desacoplaron, su primer
+# bloque enlaza con el último hash de esa cadena en el sello de la última de ellas
+SEEDS_SQL = """
+    SELECT DISTINCT ON (c.chain) c.chain, c.last_hash
+    FROM ledger_segment_chain c
+    JOIN ledger_segment s USING (partition)
+    WHERE s.detached_at IS NOT NULL
+      AND c.last_id < (SELECT MIN(id) FROM ledger l WHERE l.chain = c.chain)
+    ORDER BY c.chain, s.period_start DESC;
+"""
+
+
+# -----------------------------
+# Export
+# -----------------------------
+def pack_hash(h: bytes, label_flag: int) -> Tuple[bytes, int]:
+    # (32 bytes, flag): digest tal cual; etiqueta (genesis) rellena con ceros
+    if len(h) == 32:
+        return h, 0
+    if len(h) > 32 or b"\0" in h:
+        raise ValueError(f"hash no representable en el snapshot: {h!r}")
+    return h.ljust(32, b"\0"), label_flag
+
+
+def unpack_hash(raw: bytes, is_label: bool) -> bytes:
+    return raw.rstrip(b"\0") if is_label else raw
+
+
+def export(path: str) -> int:
+    # solo export necesita Postgres: verify corre en la máquina del auditor sin dependencias de la API
+    import psycopg
+
+    from db import dsn
+
+    count = 0
+    started = time.perf_counter()
+    heap_off = 0
+    # índice directo al archivo final y heap a un temporal: al final se concatena y se completa el header
+    with open(path, "wb") as out, tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path))) as heap:
+        out.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0, 0))
+        with psycopg.connect(dsn()) as conn:
+            # snapshot consistente de toda la tabla aunque la API siga escribiendo
+            conn.read_only = True
+            conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+            with conn.cursor(name="ledger_snapshot") as cur:
+                cur.itersize = CHUNK
+                cur.execute(SNAPSHOT_SQL)
+                while True:
+                    rows = cur.fetchmany(CHUNK)
+                    if not rows:
+                        break
+                    records = []
+                    blobs = []
+                    for block_id, ts, actor, action, tx_id, prev_hash, payload_json, h, chain in rows:
+                        prev_raw, prev_flag = pack_hash(bytes(prev_hash), FLAG_PREV_LABEL)
+                        hash_raw, hash_flag = pack_hash(bytes(h), FLAG_HASH_LABEL)
+                        fields = [str(v).encode("utf-8") for v in (actor, action, tx_id, payload_json)]
+                        records.append(
+                            RECORD.pack(
+                                int(block_id),
+                                (ts - EPOCH) // timedelta(microseconds=1),
+                                prev_raw,
+                                hash_raw,
+                                prev_flag | hash_flag,
+                                int(chain),
+                                *(len(f) for f in fields),
+                                heap_off,
+                            )
+                        )
+                        blobs.extend(fields)
+                        heap_off += sum(len(f) for f in fields)
+                    out.write(b"".join(records))
+                    heap.write(b"".join(blobs))
+                    count += len(rows)
+                    elapsed = time.perf_counter() - started
+                    print(f"  exportados {count} bloques ({count / elapsed:.0f} bloques/s)")
+            # en la misma transacción: semillas coherentes con los bloques exportados
+            seeds = [(int(chain), bytes(h)) for chain, h in conn.execute(SEEDS_SQL).fetchall()]
+
+        heap_start = out.tell()
+        heap.seek(0)
+        while True:
+            buf = heap.read(1 << 20)
+            if not buf:
+                break
+            out.write(buf)
+        out.write(b"".join(SEED.pack(chain, h) for chain, h in seeds))
+        out.write(FOOTER.pack(len(seeds)))
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, VERSION, RECORD.size, count, heap_start))
+    return count
+
+
+# -----------------------------
+# Verify
+# -----------------------------
+@dataclass
+class RangeResult:
+    # resultado de un rango de registros; first_prev/last_hash sirven para empalmar con los vecinos
+    ok: bool = True
+    checked: int = 0
+    first_id: Optional[int] = None
+    first_prev: Optional[bytes] = None
+    last_id: Optional[int] = None
+    last_hash: Optional[bytes] = None
+    failed_id: Optional[int] = None
+
+
+Anchor = Tuple[int, str]  # (id del bloque ancla, payload_json)
+
+
+def read_header(mm) -> Tuple[int, int]:
+    magic, version, record_size, count, heap_start = HEADER.unpack_from(mm, 0)
+    if magic != MAGIC or version not in VERSIONS or record_size != RECORD.size:
+        raise ValueError("archivo que no es un snapshot del ledger (o de otra versión)")
+    return count, heap_start
+
+
+def read_seeds(mm) -> Dict[int, bytes]:
+    # versión 3: {chain: hash} de las cadenas que no arrancan en su genesis (las demás no figuran)
+    if HEADER.unpack_from(mm, 0)[1] < 3:
+        return {}
+    (n,) = FOOTER.unpack_from(mm, len(mm) - FOOTER.size)
+    start = len(mm) - FOOTER.size - n * SEED.size
+    return dict(SEED.unpack_from(mm, start + i * SEED.size) for i in range(n))
+
+
+def verify_range(args: Tuple[str, int, int]) -> Tuple[Dict[int, RangeResult], List[Anchor]]:
+    # mismo criterio que check_blocks de la API, sobre los registros [start, end) del snapshot y por sub-cadena:
+    # una cadena rota deja de revisarse, las demás siguen. También junta las anclas para validarlas al final
+    path, start, end = args
+    chains: Dict[int, RangeResult] = {}
+    anchors: List[Anchor] = []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        _, heap_start = read_header(mm)
+        offset = HEADER.size + start * RECORD.size
+        for _ in range(start, end):
+            block_id, ts_us, prev_raw, hash_raw, flags, chain, la, lb, lc, ld, heap_off = RECORD.unpack_from(mm, offset)
+            offset += RECORD.size
+            # bloques no-sha256 (genesis sembrado) no forman parte de la cadena verificable
+            if flags & FLAG_HASH_LABEL:
+                continue
+            res = chains.setdefault(chain, RangeResult())
+            if not res.ok:
+                continue
+
+            block_prev = unpack_hash(prev_raw, bool(flags & FLAG_PREV_LABEL))
+            if res.last_hash is None:
+                res.first_id, res.first_prev = block_id, block_prev
+            elif block_prev != res.last_hash:
+                res.ok, res.failed_id = False, block_id
+                continue
+
+            p = heap_start + heap_off
+            actor = mm[p:p + la].decode("utf-8")
+            p += la
+            action = mm[p:p + lb].decode("utf-8")
+            p += lb
+            tx_id = mm[p:p + lc].decode("utf-8")
+            p += lc
+            payload_json = mm[p:p + ld].decode("utf-8")
+            ts = EPOCH + timedelta(microseconds=ts_us)
+
+            expected = compute_block_digest(hash_text(block_prev), ts.isoformat(), actor, action, tx_id, payload_json)
+            if expected != hash_raw:
+                res.ok, res.failed_id = False, block_id
+                continue
+
+            res.checked += 1
+            res.last_id, res.last_hash = block_id, hash_raw
+            if chain == 0 and action == ANCHOR_ACTION:
+                anchors.append((block_id, payload_json))
+    return chains, anchors
+
+
+def stitch(results: List[RangeResult], genesis: Optional[bytes]) -> RangeResult:
+    # une los rangos de una cadena en orden: el primer bloque de cada rango debe enlazar con el último del
+    # anterior, y el primero de todos con `genesis`: el de la sub-cadena (None en la 0: genesis legado) o su semilla
+    total = RangeResult(last_hash=genesis)
+    for r in results:
+        if r.first_id is not None and total.last_hash is not None and r.first_prev != total.last_hash:
+            total.ok, total.failed_id = False, r.first_id
+            return total
+        total.checked += r.checked
+        if total.first_id is None:
+            total.first_id = r.first_id
+        if r.last_id is not None:
+            total.last_id, total.last_hash = r.last_id, r.last_hash
+        if not r.ok:
+            total.ok, total.failed_id = False, r.failed_id
+            return total
+    return total
+
+
+def find_record(mm, count: int, block_id: int) -> Optional[Tuple[int, bytes]]:
+    # (chain, hash) del bloque `block_id`: búsqueda binaria en el índice (ordenado por id)
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        record = RECORD.unpack_from(mm, HEADER.size + mid * RECORD.size)
+        if record[0] < block_id:
+            lo = mid + 1
+        elif record[0] > block_id:
+            hi = mid
+        else:
+            return record[5], record[3]
+    return None
+
+
+def check_anchors(path: str, anchors: List[Anchor], chains: Dict[int, RangeResult]) -> Optional[int]:
+    # id de la primera ancla con una cabeza que no está en el snapshot (o con otro hash/cadena); None si todas.
+    # Las cabezas anteriores al primer bloque de su cadena quedaron fuera (particiones desacopladas): se saltan
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        count, _ = read_header(mm)
+        for anchor_id, payload_json in anchors:
+            for chain, head in json.loads(payload_json).get("heads", {}).items():
+                first = chains.get(int(chain), RangeResult()).first_id
+                if first is not None and int(head["id"]) < first:
+                    continue
+                if find_record(mm, count, int(head["id"])) != (int(chain), bytes.fromhex(head["hash"])):
+                    return anchor_id
+    return None
+
+
+def verify(path: str) -> Tuple[RangeResult, Dict[int, RangeResult]]:
+    # (total, por cadena); en el total failed_id es el menor de todas las cadenas (o el ancla inválida)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        count, _ = read_header(mm)
+        seeds = read_seeds(mm)
+    if count == 0:
+        return RangeResult(), {}
+
+    # más rangos que workers: reparte mejor si algunos rangos tienen payloads más grandes
+    n_ranges = max(1, min(count, WORKERS * 4))
+    step = -(-count // n_ranges)
+    ranges = [(path, s, min(s + step, count)) for s in range(0, count, step)]
+    if WORKERS <= 1:
+        parts = [verify_range(r) for r in ranges]
+    else:
+        with ProcessPoolExecutor(max_workers=WORKERS) as pool:
+            parts = list(pool.map(verify_range, ranges))
+
+    ids = sorted({chain for part, _ in parts for chain in part})
+    chains = {c: stitch([part[c] for part, _ in parts if c in part], seeds.get(c, chain_genesis(c))) for c in ids}
+    total = RangeResult(ok=all(r.ok for r in chains.values()), checked=sum(r.checked for r in chains.values()))
+    failed = [r.failed_id for r in chains.values() if r.failed_id is not None]
+    total.failed_id = min(failed) if failed else None
+    if total.ok:
+        total.failed_id = check_anchors(path, [a for _, anchors in parts for a in anchors], chains)
+        total.ok = total.failed_id is None
+    return total, chains
+
+
+def main() -> None:
+    if len(sys.argv) != 3 or sys.argv[1] not in ("export", "verify"):
+        print("Uso: python ledger_snapshot.py export|verify <archivo>")
+        sys.exit(2)
+
+    command, path = sys.argv[1], sys.argv[2]
+    started = time.perf_counter()
+    if command == "export":
+        count = export(path)
+        print(f"Snapshot listo: {count} bloques en {path} ({time.perf_counter() - started:.1f}s)")
+        return
+
+    res, chains = verify(path)
+    elapsed = time.perf_counter() - started
+    rate = res.checked / elapsed if elapsed else 0.0
+    print(f"Verificados {res.checked} bloques con {WORKERS} procesos en {elapsed:.2f}s ({rate:.0f} bloques/s)")
+    if res.ok:
+        # el auditor compara la cabeza de cada cadena con la publicada (GET /ledger/verify, /ledger/segments)
+        print("Integridad OK.")
+        for chain, r in sorted(chains.items()):
+            if r.last_id is not None:
+                print(f"  cadena {chain}: {r.checked} bloques, último id={r.last_id} hash={hash_text(r.last_hash)}")
+    else:
+        print(f"Integridad con errores: primer bloque inválido id={res.failed_id}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
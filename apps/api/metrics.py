@@ -0,0 +1,147 @@
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Any, Dict, Iterator, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Métricas Prometheus del proceso (un solo worker uvicorn: registro por defecto, sin modo multiproceso)
+
+# buckets en segundos: de 1 ms (consultas simples) a 30 s (verificación completa)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "nexus_http_request_duration_seconds",
+    "Latencia de requests HTTP por ruta y rol",
+    ["method", "route", "role"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS = Counter(
+    "nexus_http_requests_total",
+    "Requests HTTP por ruta, rol y status",
+    ["method", "route", "role", "status"],
+)
+HTTP_IN_FLIGHT = Gauge("nexus_http_requests_in_flight", "Requests HTTP en curso")
+
+DB_QUERY_SECONDS = Histogram(
+    "nexus_db_query_duration_seconds",
+    "Latencia de consultas de los helpers de db.py (operación + tabla)",
+    ["helper", "query"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_POOL = Gauge("nexus_db_pool_connections", "Conexiones del pool por estado", ["state"])
+DB_READS = Counter("nexus_db_reads_total", "Lecturas de los helpers de db.py por destino", ["target"])
+DB_REPLICA_UP = Gauge("nexus_db_replica_up", "Réplica de lectura en rotación (1) o fuera (0)", ["replica"])
+DB_REPLICA_LAG = Gauge(
+    "nexus_db_replica_lag_seconds",
+    "Segundos desde que la réplica alcanzó por última vez el LSN de la primaria",
+    ["replica"],
+)
+
+LEDGER_APPEND_SECONDS = Histogram(
+    "nexus_ledger_append_duration_seconds",
+    "Latencia de append al ledger (lock de cabeza + insert + Merkle, sin commit)",
+    buckets=LATENCY_BUCKETS,
+)
+LEDGER_LOCK_WAIT_SECONDS = Histogram(
+    "nexus_ledger_lock_wait_seconds",
+    "Espera del lock de cabeza del ledger",
+    buckets=LATENCY_BUCKETS,
+)
+LEDGER_BLOCKS_APPENDED = Counter("nexus_ledger_blocks_appended_total", "Bloques agregados al ledger")
+LEDGER_ANCHORS = Counter("nexus_ledger_anchors_total", "Anclas de sub-cadenas escritas en la cadena 0")
+
+VERIFY_SECONDS = Histogram(
+    "nexus_ledger_verify_duration_seconds",
+    "Duración de la verificación de la cadena por modo",
+    ["mode"],
+    buckets=LATENCY_BUCKETS,
+)
+VERIFY_BLOCKS = Counter("nexus_ledger_verify_blocks_total", "Bloques verificados", ["mode"])
+VERIFY_BLOCKS_PER_SECOND = Gauge(
+    "nexus_ledger_verify_blocks_per_second",
+    "Bloques/s de la última verificación por modo",
+    ["mode"],
+)
+
+STREAM_SUBSCRIBERS = Gauge("nexus_stream_subscribers", "Clientes conectados a GET /ledger/stream")
+
+# rol del request en curso: el middleware crea el holder y require_auth lo completa
+_request_role: ContextVar[Optional[Dict[str, str]]] = ContextVar("nexus_request_role", default=None)
+
+_SQL_OP = re.compile(r"^\s*(SELECT|INSERT\s+INTO|UPDATE|DELETE\s+FROM|WITH)\b", re.IGNORECASE)
+_SQL_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+([a-z_][a-z0-9_]*)", re.IGNORECASE)
+
+
+def set_role(role: str) -> None:
+    holder = _request_role.get()
+    if holder is not None:
+        holder["role"] = role
+
+
+@lru_cache(maxsize=256)
+def query_label(sql: str) -> str:
+    # etiqueta acotada: "select inventory", "insert invoices"... (las consultas son literales del código)
+    op = _SQL_OP.match(sql)
+    table = _SQL_TABLE.search(sql)
+    op_name = op.group(1).split()[0].lower() if op else "other"
+    return f"{op_name} {table.group(1).lower()}" if table else op_name
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        (histogram.labels(**labels) if labels else histogram).observe(time.perf_counter() - t0)
+
+
+def render(pool: Dict[str, Any]) -> bytes:
+    DB_POOL.labels("size").set(int(pool.get("pool_size", 0)))
+    DB_POOL.labels("available").set(int(pool.get("pool_available", 0)))
+    DB_POOL.labels("in_use").set(int(pool.get("in_use", 0)))
+    DB_POOL.labels("waiting").set(int(pool.get("requests_waiting", 0)))
+    for replica in pool.get("replicas", []):
+        DB_REPLICA_UP.labels(replica["host"]).set(1 if replica["healthy"] else 0)
+        if replica["lag_seconds"] is not None:
+            DB_REPLICA_LAG.labels(replica["host"]).set(replica["lag_seconds"])
+    return generate_latest()
+
+
+class MetricsMiddleware:
+    # ASGI puro (sin BaseHTTPMiddleware): una medición por request, sin tareas extra
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        holder = {"role": "anon"}
+        token = _request_role.set(holder)
+        status_code = 500
+
+        async def send_with_status(message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - t0
+            HTTP_IN_FLIGHT.dec()
+            _request_role.reset(token)
+            # plantilla de la ruta (/admin/invoices/{invoice_id}/approve), no el path: cardinalidad acotada
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            HTTP_REQUEST_SECONDS.labels(method, route, holder["role"]).observe(elapsed)
+            HTTP_REQUESTS.labels(method, route, holder["role"], str(status_code)).inc()
+
@@ -0,0 +1,716 @@
+import asyncio
+import sys
+from typing import List, Tuple
+
+import psycopg
+
+from db import close_pool, connection, dsn, open_pool
+
+# Migraciones versionadas: (versión, nombre, sentencias). Solo se agregan al final, nunca se editan.
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (
+        1,
+        "columnas base (payload_json, status, inventory_id)",
+        [
+            "ALTER TABLE ledger ADD COLUMN IF NOT EXISTS payload_json TEXT;",
+            "ALTER TABLE inventory ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'AVAILABLE';",
+            "ALTER TABLE invoices ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'APPROVED';",
+            "ALTER TABLE invoices ADD COLUMN IF NOT EXISTS inventory_id INT;",
+        ],
+    ),
+    (
+        2,
+        "FK invoices.inventory_id -> inventory.id",
+        [
+            # solo si no hay ya un FK sobre la columna (el init.sql lo crea con otro nombre)
+            """
+            DO $$
+            BEGIN
+              IF NOT EXISTS (
+                SELECT 1
+                FROM pg_constraint c
+                JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY (c.conkey)
+                WHERE c.conrelid = 'invoices'::regclass AND c.contype = 'f' AND a.attname = 'inventory_id'
+              ) THEN
+                ALTER TABLE invoices
+                ADD CONSTRAINT invoices_inventory_fk
+                FOREIGN KEY (inventory_id) REFERENCES inventory(id) NOT VALID;
+              END IF;
+            END $$;
+            """,
+        ],
+    ),
+    (
+        3,
+        "checkpoint de verificación incremental",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS ledger_checkpoint (
+              id          SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+              last_id     INT NOT NULL,
+              last_hash   TEXT NOT NULL,
+              verified_at TIMESTAMPTZ NOT NULL
+            );
+            """,
+        ],
+    ),
+    (
+        4,
+        "cabeza de la cadena",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS ledger_head (
+              id         SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+              last_id    INT NOT NULL,
+              hash       TEXT NOT NULL,
+              updated_at TIMESTAMPTZ NOT NULL
+            );
+            """,
+            """
+            INSERT INTO ledger_head(id, last_id, hash, updated_at)
+            SELECT 1, COALESCE(l.id, 0), COALESCE(l.hash, repeat('0', 64)), now()
+            FROM (SELECT 1) AS one
+            LEFT JOIN (SELECT id, hash FROM ledger ORDER BY id DESC LIMIT 1) AS l ON TRUE
+            ON CONFLICT (id) DO NOTHING;
+            """,
+        ],
+    ),
+    (
+        5,
+        "raíces Merkle por segmento",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS ledger_merkle (
+              segment    INT PRIMARY KEY,
+              first_id   INT NOT NULL,
+              last_id    INT NOT NULL,
+              leaf_count INT NOT NULL,
+              frontier   TEXT NOT NULL,
+              root       TEXT NOT NULL
+            );
+            """,
+        ],
+    ),
+    (
+        6,
+        "índices para las consultas calientes",
+        [
+            # listados por estado (parciales: solo las filas que se consultan, ordenadas por id)
+            "CREATE INDEX IF NOT EXISTS inventory_available_idx ON inventory (id) WHERE status = 'AVAILABLE';",
+            "CREATE INDEX IF NOT EXISTS invoices_pending_idx ON invoices (id) WHERE status = 'PENDING_APPROVAL';",
+            "CREATE INDEX IF NOT EXISTS invoices_inventory_id_idx ON invoices (inventory_id);",
+            # ledger por tx_id (pruebas Merkle, auditoría) y búsquedas por hash
+            "CREATE INDEX IF NOT EXISTS ledger_tx_id_idx ON ledger (tx_id, id);",
+            "CREATE INDEX IF NOT EXISTS ledger_hash_idx ON ledger (hash);",
+            "CREATE INDEX IF NOT EXISTS inventory_hash_idx ON inventory (hash) WHERE hash <> 'PENDING';",
+            "CREATE INDEX IF NOT EXISTS invoices_hash_idx ON invoices (hash) WHERE hash <> 'PENDING';",
+        ],
+    ),
+    (
+        7,
+        "notificación de escrituras para el cache de lecturas",
+        [
+            # por sentencia (no por fila) y con el nombre de la tabla: NOTIFY colapsa duplicados en la transacción
+            """
+            CREATE OR REPLACE FUNCTION nexus_cache_notify() RETURNS trigger AS $$
+            BEGIN
+              PERFORM pg_notify('nexus_cache', TG_TABLE_NAME);
+              RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            "DROP TRIGGER IF EXISTS inventory_cache_notify ON inventory;",
+            """
+            CREATE TRIGGER inventory_cache_notify
+            AFTER INSERT OR UPDATE OR DELETE ON inventory
+            FOR EACH STATEMENT EXECUTE FUNCTION nexus_cache_notify();
+            """,
+            "DROP TRIGGER IF EXISTS invoices_cache_notify ON invoices;",
+            """
+            CREATE TRIGGER invoices_cache_notify
+            AFTER INSERT OR UPDATE OR DELETE ON invoices
+            FOR EACH STATEMENT EXECUTE FUNCTION nexus_cache_notify();
+            """,
+        ],
+    ),
+    (
+        8,
+        "hashes como BYTEA (32 bytes), NULL en vez de 'PENDING'",
+        [
+            # hex de 64 -> 32 bytes; 'PENDING' -> NULL; rótulos legados (genesis) -> sus bytes UTF-8
+            """
+            CREATE OR REPLACE FUNCTION nexus_hash_bytes(h TEXT) RETURNS BYTEA AS $$
+              SELECT CASE
+                WHEN h IS NULL OR h = 'PENDING' THEN NULL
+                WHEN h ~ '^[0-9a-fA-F]{64}$' THEN decode(h, 'hex')
+                ELSE convert_to(h, 'UTF8')
+              END;
+            $$ LANGUAGE sql IMMUTABLE;
+            """,
+            # los índices parciales comparan contra 'PENDING' (texto): se recrean con IS NOT NULL
+            "DROP INDEX IF EXISTS inventory_hash_idx;",
+            "DROP INDEX IF EXISTS invoices_hash_idx;",
+            """
+            ALTER TABLE inventory
+              ALTER COLUMN hash DROP DEFAULT,
+              ALTER COLUMN hash DROP NOT NULL,
+              ALTER COLUMN hash TYPE BYTEA USING nexus_hash_bytes(hash);
+            """,
+            """
+            ALTER TABLE invoices
+              ALTER COLUMN hash DROP DEFAULT,
+              ALTER COLUMN hash DROP NOT NULL,
+              ALTER COLUMN hash TYPE BYTEA USING nexus_hash_bytes(hash);
+            """,
+            # una sola reescritura de la tabla para ambas columnas
+            """
+            ALTER TABLE ledger
+              ALTER COLUMN prev_hash TYPE BYTEA USING nexus_hash_bytes(prev_hash),
+              ALTER COLUMN hash TYPE BYTEA USING nexus_hash_bytes(hash);
+            """,
+            "ALTER TABLE ledger_head ALTER COLUMN hash TYPE BYTEA USING nexus_hash_bytes(hash);",
+            "ALTER TABLE ledger_checkpoint ALTER COLUMN last_hash TYPE BYTEA USING nexus_hash_bytes(last_hash);",
+            "CREATE INDEX IF NOT EXISTS inventory_hash_idx ON inventory (hash) WHERE hash IS NOT NULL;",
+            "CREATE INDEX IF NOT EXISTS invoices_hash_idx ON invoices (hash) WHERE hash IS NOT NULL;",
+            "DROP FUNCTION nexus_hash_bytes(TEXT);",
+        ],
+    ),
+    (
+        9,
+        "ledger particionado por mes + segmentos sellados",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS ledger_segment (
+              partition       TEXT PRIMARY KEY,
+              period_start    TIMESTAMPTZ NOT NULL,
+              period_end      TIMESTAMPTZ NOT NULL,
+              first_id        INT,
+              last_id         INT,
+              block_count     INT,
+              first_prev_hash BYTEA,
+              last_hash       BYTEA,
+              digest          BYTEA,
+              sealed_at       TIMESTAMPTZ,
+              detached_at     TIMESTAMPTZ
+            );
+            """,
+            # una partición por mes (UTC): ledger_yYYYYmMM; la app la crea al primer bloque del mes
+            """
+            CREATE OR REPLACE FUNCTION ledger_ensure_partition(p_ts TIMESTAMPTZ) RETURNS TEXT AS $$
+            DECLARE
+              m    TIMESTAMP := date_trunc('month', p_ts AT TIME ZONE 'UTC');
+              lo   TIMESTAMPTZ := m AT TIME ZONE 'UTC';
+              hi   TIMESTAMPTZ := (m + interval '1 month') AT TIME ZONE 'UTC';
+              name TEXT := 'ledger_y' || to_char(m, 'YYYY') || 'm' || to_char(m, 'MM');
+            BEGIN
+              IF to_regclass(name) IS NULL THEN
+                EXECUTE format('CREATE TABLE %I PARTITION OF ledger FOR VALUES FROM (%L) TO (%L)', name, lo, hi);
+                INSERT INTO ledger_segment(partition, period_start, period_end)
+                VALUES (name, lo, hi)
+                ON CONFLICT (partition) DO NOTHING;
+              END IF;
+              RETURN name;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            # reescritura única: la tabla actual pasa a ser la madre particionada (PK incluye ts)
+            """
+            DO $$
+            DECLARE
+              t TIMESTAMPTZ;
+            BEGIN
+              IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'ledger'::regclass) THEN
+                RETURN;
+              END IF;
+
+              ALTER TABLE ledger RENAME TO ledger_unpartitioned;
+              ALTER INDEX IF EXISTS ledger_pkey RENAME TO ledger_unpartitioned_pkey;
+              DROP INDEX IF EXISTS ledger_tx_id_idx;
+              DROP INDEX IF EXISTS ledger_hash_idx;
+              -- la secuencia del SERIAL sobrevive al DROP de la tabla vieja
+              ALTER SEQUENCE ledger_id_seq OWNED BY NONE;
+
+              CREATE TABLE ledger (
+                id           INT NOT NULL DEFAULT nextval('ledger_id_seq'),
+                ts           TIMESTAMPTZ NOT NULL,
+                actor        TEXT NOT NULL,
+                action       TEXT NOT NULL,
+                tx_id        TEXT NOT NULL,
+                prev_hash    BYTEA NOT NULL,
+                payload_json TEXT DEFAULT '{}',
+                hash         BYTEA NOT NULL,
+                PRIMARY KEY (id, ts)
+              ) PARTITION BY RANGE (ts);
+              ALTER SEQUENCE ledger_id_seq OWNED BY ledger.id;
+
+              FOR t IN
+                SELECT DISTINCT date_trunc('month', ts AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' FROM ledger_unpartitioned
+                UNION
+                SELECT now()
+              LOOP
+                PERFORM ledger_ensure_partition(t);
+              END LOOP;
+
+              INSERT INTO ledger(id, ts, actor, action, tx_id, prev_hash, payload_json, hash)
+              SELECT id, ts, actor, action, tx_id, prev_hash, payload_json, hash
+              FROM ledger_unpartitioned
+              ORDER BY id;
+              DROP TABLE ledger_unpartitioned;
+            END $$;
+            """,
+            # índices particionados: se crean en cada partición actual y futura
+            "CREATE INDEX IF NOT EXISTS ledger_tx_id_idx ON ledger (tx_id, id);",
+            "CREATE INDEX IF NOT EXISTS ledger_hash_idx ON ledger (hash);",
+        ],
+    ),
+    (
+        10,
+        "notificaciones para el stream en vivo (ledger y pendientes)",
+        [
+            # ledger: un aviso por sentencia sin payload (el stream relee desde su último id publicado)
+            """
+            CREATE OR REPLACE FUNCTION nexus_ledger_notify() RETURNS trigger AS $$
+            BEGIN
+              PERFORM pg_notify('nexus_ledger', '');
+              RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            "DROP TRIGGER IF EXISTS ledger_stream_notify ON ledger;",
+            """
+            CREATE TRIGGER ledger_stream_notify
+            AFTER INSERT ON ledger
+            FOR EACH STATEMENT EXECUTE FUNCTION nexus_ledger_notify();
+            """,
+            # facturas: por fila con el id, solo si cambia el estado (entra o sale de la cola de pendientes)
+            """
+            CREATE OR REPLACE FUNCTION nexus_pending_notify() RETURNS trigger AS $$
+            BEGIN
+              IF TG_OP = 'INSERT' OR NEW.status IS DISTINCT FROM OLD.status THEN
+                PERFORM pg_notify('nexus_pending', NEW.id::text);
+              END IF;
+              RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            "DROP TRIGGER IF EXISTS invoices_pending_notify ON invoices;",
+            """
+            CREATE TRIGGER invoices_pending_notify
+            AFTER INSERT OR UPDATE OF status ON invoices
+            FOR EACH ROW EXECUTE FUNCTION nexus_pending_notify();
+            """,
+        ],
+    ),
+    (
+        11,
+        "contadores incrementales para /stats",
+        [
+            # contadores repartidos en 16 slots (pg_backend_pid() % 16): escrituras concurrentes no compiten por
+            # la misma fila; /stats suma a lo sumo 16 filas por contador
+            """
+            CREATE TABLE IF NOT EXISTS stats_counter (
+              name   TEXT     NOT NULL,
+              slot   SMALLINT NOT NULL,
+              n      BIGINT   NOT NULL DEFAULT 0,
+              amount NUMERIC  NOT NULL DEFAULT 0,
+              PRIMARY KEY (name, slot)
+            );
+            """,
+            # deltas agrupados por estado en un solo upsert; mismo orden de filas (ORDER BY 1) en todas las
+            # transacciones: sin deadlocks entre contadores. Un UPDATE que no cambia el estado no toca nada
+            """
+            CREATE OR REPLACE FUNCTION nexus_stats_apply(p_prefix TEXT, p_status TEXT[], p_n INT[], p_amount NUMERIC[])
+            RETURNS void AS $$
+              INSERT INTO stats_counter(name, slot, n, amount)
+              SELECT p_prefix || status, pg_backend_pid() % 16, SUM(d), SUM(a)
+              FROM unnest(p_status, p_n, p_amount) AS delta(status, d, a)
+              GROUP BY status
+              HAVING SUM(d) <> 0 OR SUM(a) <> 0
+              ORDER BY 1
+              ON CONFLICT (name, slot) DO UPDATE
+                SET n = stats_counter.n + EXCLUDED.n, amount = stats_counter.amount + EXCLUDED.amount;
+            $$ LANGUAGE sql;
+            """,
+            # por sentencia con tablas de transición: un batch de N filas es un solo upsert por estado
+            """
+            CREATE OR REPLACE FUNCTION nexus_stats_inventory() RETURNS trigger AS $$
+            DECLARE
+              st TEXT[] := '{}';
+              d  INT[] := '{}';
+              a  NUMERIC[] := '{}';
+            BEGIN
+              -- old_rows/new_rows solo existen según la operación: cada rama se planifica al ejecutarse
+              IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                SELECT st || array_agg(status), d || array_agg(1), a || array_agg(qty::numeric)
+                INTO st, d, a FROM new_rows;
+              END IF;
+              IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                SELECT st || array_agg(status), d || array_agg(-1), a || array_agg(-qty::numeric)
+                INTO st, d, a FROM old_rows;
+              END IF;
+              PERFORM nexus_stats_apply('inventory:', st, d, a);
+              RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            "DROP TRIGGER IF EXISTS inventory_stats_insert ON inventory;",
+            """
+            CREATE TRIGGER inventory_stats_insert
+            AFTER INSERT ON inventory REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION nexus_stats_inventory();
+            """,
+            "DROP TRIGGER IF EXISTS inventory_stats_update ON inventory;",
+            """
+            CREATE TRIGGER inventory_stats_update
+            AFTER UPDATE ON inventory REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION nexus_stats_inventory();
+            """,
+            "DROP TRIGGER IF EXISTS inventory_stats_delete ON inventory;",
+            """
+            CREATE TRIGGER inventory_stats_delete
+            AFTER DELETE ON inventory REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION nexus_stats_inventory();
+            """,
+            """
+            CREATE OR REPLACE FUNCTION nexus_stats_invoices() RETURNS trigger AS $$
+            DECLARE
+              st TEXT[] := '{}';
+              d  INT[] := '{}';
+              a  NUMERIC[] := '{}';
+            BEGIN
+              -- old_rows/new_rows solo existen según la operación: cada rama se planifica al ejecutarse
+              IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                SELECT st || array_agg(status), d || array_agg(1), a || array_agg(total::numeric)
+                INTO st, d, a FROM new_rows;
+              END IF;
+              IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                SELECT st || array_agg(status), d || array_agg(-1), a || array_agg(-total::numeric)
+                INTO st, d, a FROM old_rows;
+              END IF;
+              PERFORM nexus_stats_apply('invoices:', st, d, a);
+              RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            "DROP TRIGGER IF EXISTS invoices_stats_insert ON invoices;",
+            """
+            CREATE TRIGGER invoices_stats_insert
+            AFTER INSERT ON invoices REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION nexus_stats_invoices();
+            """,
+            "DROP TRIGGER IF EXISTS invoices_stats_update ON invoices;",
+            """
+            CREATE TRIGGER invoices_stats_update
+            AFTER UPDATE ON invoices REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION nexus_stats_invoices();
+            """,
+            "DROP TRIGGER IF EXISTS invoices_stats_delete ON invoices;",
+            """
+            CREATE TRIGGER invoices_stats_delete
+            AFTER DELETE ON invoices REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION nexus_stats_invoices();
+            """,
+            """
+            CREATE OR REPLACE FUNCTION nexus_stats_ledger() RETURNS trigger AS $$
+            BEGIN
+              INSERT INTO stats_counter(name, slot, n)
+              SELECT 'ledger', pg_backend_pid() % 16, COUNT(*) FROM new_rows
+              ON CONFLICT (name, slot) DO UPDATE SET n = stats_counter.n + EXCLUDED.n;
+              RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            "DROP TRIGGER IF EXISTS ledger_stats_insert ON ledger;",
+            """
+            CREATE TRIGGER ledger_stats_insert
+            AFTER INSERT ON ledger REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION nexus_stats_ledger();
+            """,
+            # punto de partida: conteo completo una sola vez (en la misma transacción que crea los triggers)
+            "DELETE FROM stats_counter;",
+            """
+            INSERT INTO stats_counter(name, slot, n, amount)
+            SELECT 'inventory:' || status, 0, COUNT(*), COALESCE(SUM(qty), 0) FROM inventory GROUP BY status
+            UNION ALL
+            SELECT 'invoices:' || status, 0, COUNT(*), COALESCE(SUM(total), 0) FROM invoices GROUP BY status
+            UNION ALL
+            SELECT 'ledger', 0, COUNT(*), 0 FROM ledger;
+            """,
+        ],
+    ),
+    (
+        12,
+        "índice JSONB sobre payload_json del ledger",
+        [
+            # índice de expresión (jsonb_path_ops: @>, @?, @@) sobre el texto canónico: payload_json sigue siendo
+            # la fuente hasheada y las particiones selladas no se reescriben (una columna nueva las reescribiría).
+            # Las consultas deben usar exactamente la misma expresión (main.LEDGER_PAYLOAD)
+            """
+            CREATE INDEX IF NOT EXISTS ledger_payload_idx
+            ON ledger USING GIN ((NULLIF(payload_json, '')::jsonb) jsonb_path_ops);
+            """,
+        ],
+    ),
+    (
+        13,
+        "sub-cadenas paralelas (cabeza, checkpoint, Merkle y sellos por cadena)",
+        [
+            # DEFAULT constante: solo catálogo, no reescribe particiones (tampoco las selladas). Lo existente es la
+            # cadena 0, donde también van las anclas
+            "ALTER TABLE ledger ADD COLUMN IF NOT EXISTS chain SMALLINT NOT NULL DEFAULT 0;",
+            "CREATE INDEX IF NOT EXISTS ledger_chain_idx ON ledger (chain, id);",
+            # una fila por cadena (antes id = 1); el CHECK se va con la columna id
+            "ALTER TABLE ledger_head ADD COLUMN IF NOT EXISTS chain SMALLINT NOT NULL DEFAULT 0;",
+            "ALTER TABLE ledger_head DROP CONSTRAINT IF EXISTS ledger_head_pkey;",
+            "ALTER TABLE ledger_head DROP COLUMN IF EXISTS id;",
+            "ALTER TABLE ledger_head ADD PRIMARY KEY (chain);",
+            "ALTER TABLE ledger_checkpoint ADD COLUMN IF NOT EXISTS chain SMALLINT NOT NULL DEFAULT 0;",
+            "ALTER TABLE ledger_checkpoint DROP CONSTRAINT IF EXISTS ledger_checkpoint_pkey;",
+            "ALTER TABLE ledger_checkpoint DROP COLUMN IF EXISTS id;",
+            "ALTER TABLE ledger_checkpoint ADD PRIMARY KEY (chain);",
+            # segmentos Merkle numerados por cadena: cada una avanza su cola sin tocar la de las otras
+            "ALTER TABLE ledger_merkle ADD COLUMN IF NOT EXISTS chain SMALLINT NOT NULL DEFAULT 0;",
+            "ALTER TABLE ledger_merkle DROP CONSTRAINT IF EXISTS ledger_merkle_pkey;",
+            "ALTER TABLE ledger_merkle ADD PRIMARY KEY (chain, segment);",
+            # sello de cada cadena dentro de cada partición; los sellos existentes son de la cadena 0.
+            # ledger_segment conserva el período, sealed_at/detached_at y los ids extremos de toda la partición
+            """
+            CREATE TABLE IF NOT EXISTS ledger_segment_chain (
+              partition       TEXT NOT NULL REFERENCES ledger_segment(partition),
+              chain           SMALLINT NOT NULL,
+              first_id        INT NOT NULL,
+              last_id         INT NOT NULL,
+              block_count     INT NOT NULL,
+              first_prev_hash BYTEA NOT NULL,
+              last_hash       BYTEA NOT NULL,
+              digest          BYTEA,
+              PRIMARY KEY (partition, chain)
+            );
+            """,
+            """
+            INSERT INTO ledger_segment_chain(partition, chain, first_id, last_id, block_count, first_prev_hash, last_hash, digest)
+            SELECT partition, 0, first_id, last_id, block_count, first_prev_hash, last_hash, digest
+            FROM ledger_segment
+            WHERE sealed_at IS NOT NULL AND first_id IS NOT NULL
+            ON CONFLICT DO NOTHING;
+            """,
+            # espejo de ledger.chain_for(): la aprobación elige la cabeza dentro de la misma sentencia que la bloquea
+            """
+            CREATE OR REPLACE FUNCTION ledger_chain_for(p_key TEXT, p_chains INT) RETURNS SMALLINT AS $$
+              SELECT CASE
+                WHEN p_chains <= 1 THEN 0
+                ELSE 1 + ('x' || substr(md5(COALESCE(p_key, '')), 1, 8))::bit(32)::bigint % p_chains
+              END::smallint;
+            $$ LANGUAGE sql IMMUTABLE;
+            """,
+            # appends de distintas cabezas pueden abrir el mismo mes a la vez: la creación se serializa con un
+            # advisory lock (solo cuando la partición falta; después es la misma consulta al catálogo de siempre)
+            """
+            CREATE OR REPLACE FUNCTION ledger_ensure_partition(p_ts TIMESTAMPTZ) RETURNS TEXT AS $$
+            DECLARE
+              m    TIMESTAMP := date_trunc('month', p_ts AT TIME ZONE 'UTC');
+              lo   TIMESTAMPTZ := m AT TIME ZONE 'UTC';
+              hi   TIMESTAMPTZ := (m + interval '1 month') AT TIME ZONE 'UTC';
+              name TEXT := 'ledger_y' || to_char(m, 'YYYY') || 'm' || to_char(m, 'MM');
+            BEGIN
+              IF to_regclass(name) IS NULL THEN
+                PERFORM pg_advisory_xact_lock(7412002);
+                -- re-chequeo con pg_class y no to_regclass: el advisory lock no refresca el cache del catálogo
+                -- y la partición que otra transacción acaba de commitear no se vería
+                IF NOT EXISTS (
+                  SELECT 1 FROM pg_class WHERE relname = name AND relnamespace = current_schema()::regnamespace
+                ) THEN
+                  EXECUTE format('CREATE TABLE %I PARTITION OF ledger FOR VALUES FROM (%L) TO (%L)', name, lo, hi);
+                  INSERT INTO ledger_segment(partition, period_start, period_end)
+                  VALUES (name, lo, hi)
+                  ON CONFLICT (partition) DO NOTHING;
+                END IF;
+              END IF;
+              RETURN name;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+        ],
+    ),
+    (
+        14,
+        "jobs de verificación compartidos entre procesos",
+        [
+            # el proceso que corre el job actualiza el avance (y updated_at) cada LEDGER_VERIFY_PROGRESS_INTERVAL;
+            # cualquier otro proceso responde el estado desde acá
+            """
+            CREATE TABLE IF NOT EXISTS ledger_verify_job (
+              id          TEXT PRIMARY KEY,
+              mode        TEXT NOT NULL,
+              engine      TEXT NOT NULL,
+              from_id     INT NOT NULL,
+              to_id       INT NOT NULL,
+              status      TEXT NOT NULL DEFAULT 'running' CHECK (status IN ('running', 'done', 'error')),
+              ok          BOOLEAN NOT NULL DEFAULT TRUE,
+              checked     BIGINT NOT NULL DEFAULT 0,
+              total       BIGINT,
+              last_id     INT,
+              failed_id   INT,
+              segments    INT,
+              chains      INT,
+              anchors     INT,
+              error       TEXT,
+              started_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+              updated_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+              finished_at TIMESTAMPTZ
+            );
+            """,
+            "CREATE INDEX IF NOT EXISTS ledger_verify_job_running_idx ON ledger_verify_job (mode) WHERE status = 'running';",
+        ],
+    ),
+    (
+        15,
+        "tokens revocados compartidos entre procesos",
+        [
+            # /auth/logout inserta acá y avisa por nexus_revoked; cada proceso carga los vigentes al (re)conectar.
+            # exp es el del token: pasada la expiración la fila ya no sirve y se purga
+            """
+            CREATE TABLE IF NOT EXISTS revoked_token (
+              token_id   TEXT PRIMARY KEY,
+              exp        BIGINT NOT NULL,
+              revoked_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            """,
+            "CREATE INDEX IF NOT EXISTS revoked_token_exp_idx ON revoked_token (exp);",
+        ],
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# clave arbitraria del advisory lock: varias réplicas arrancando a la vez migran una sola vez
+MIGRATION_LOCK_KEY = 7_412_001
+
+# consultas calientes y el índice que deben usar (ver check_indexes)
+HOT_QUERIES: List[Tuple[str, str, Tuple]] = [
+    (
+        "SELECT id FROM inventory WHERE status = 'AVAILABLE' AND id > %s ORDER BY id LIMIT 200;",
+        "inventory_available_idx",
+        (0,),
+    ),
+    (
+        "SELECT i.id FROM invoices i WHERE i.status = 'PENDING_APPROVAL' ORDER BY i.id DESC;",
+        "invoices_pending_idx",
+        (),
+    ),
+    ("SELECT id, hash FROM ledger WHERE tx_id = %s ORDER BY id LIMIT 1;", "ledger_tx_id_idx", ("TX_0000",)),
+    (
+        "SELECT id FROM ledger WHERE chain = %s AND id >= %s AND id <= %s ORDER BY id;",
+        "ledger_chain_idx",
+        (1, 0, 100),
+    ),
+    ("SELECT id FROM inventory WHERE hash = %s LIMIT 1;", "inventory_hash_idx", (bytes(32),)),
+    ("SELECT id FROM invoices WHERE hash = %s LIMIT 1;", "invoices_hash_idx", (bytes(32),)),
+    (
+        "SELECT id FROM ledger WHERE NULLIF(payload_json, '')::jsonb @> %s::jsonb ORDER BY id LIMIT 200;",
+        "ledger_payload_idx",
+        ('{"client": ""}',),
+    ),
+    (
+        "SELECT id FROM ledger WHERE NULLIF(payload_json, '')::jsonb @@ %s::jsonpath ORDER BY id LIMIT 200;",
+        "ledger_payload_idx",
+        ("$.inventory_id == 0 || $.invoice_id == 0",),
+    ),
+]
+
+
+async def current_version(cur) -> int:
+    await cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL;")
+    if not (await cur.fetchone())[0]:
+        return 0
+    await cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations;")
+    return int((await cur.fetchone())[0])
+
+
+async def migrate() -> int:
+    # devuelve cuántas migraciones se aplicaron (0 = esquema al día, arranque rápido)
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            if await current_version(cur) >= LATEST_VERSION:
+                return 0
+            await conn.commit()
+
+            await cur.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_KEY,))
+            try:
+                await cur.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                      version    INT PRIMARY KEY,
+                      name       TEXT NOT NULL,
+                      applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                    );
+                    """
+                )
+                await conn.commit()
+
+                # releer bajo el lock: otra réplica pudo haber migrado mientras esperábamos
+                version = await current_version(cur)
+                applied = 0
+                for mig_version, name, statements in MIGRATIONS:
+                    if mig_version <= version:
+                        continue
+                    # cada migración en su propia transacción, junto con su registro
+                    for sql in statements:
+                        await cur.execute(sql)
+                    await cur.execute(
+                        "INSERT INTO schema_migrations(version, name) VALUES (%s, %s);",
+                        (mig_version, name),
+                    )
+                    await conn.commit()
+                    applied += 1
+                return applied
+            finally:
+                # si una migración falló, su transacción queda abortada: descartarla antes de liberar
+                await conn.rollback()
+                await cur.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_KEY,))
+                await conn.commit()
+
+
+def check_indexes() -> List[str]:
+    # EXPLAIN de las consultas calientes con seqscan desactivado: si el plan no usa el índice
+    # esperado es que falta (o no sirve). En tablas chicas el planner prefiere seqscan, por eso se fuerza.
+    problems: List[str] = []
+    with psycopg.connect(dsn()) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SET enable_seqscan = off;")
+            for sql, index, params in HOT_QUERIES:
+                cur.execute("EXPLAIN " + sql, params)
+                plan = "\n".join(str(r[0]) for r in cur.fetchall())
+                # en tablas particionadas el plan usa los índices hijos (uno por partición)
+                cur.execute(
+                    """
+                    SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                    WHERE i.inhparent = to_regclass(%s);
+                    """,
+                    (index,),
+                )
+                names = [index] + [str(r[0]) for r in cur.fetchall()]
+                if not any(name in plan for name in names):
+                    problems.append(f"{index}: no usado por {sql.strip()}\n{plan}")
+    return problems
+
+
+async def _migrate_standalone() -> int:
+    await open_pool()
+    try:
+        return await migrate()
+    finally:
+        await close_pool()
+
+
+if __name__ == "__main__":
+    # python migrations.py           -> aplica migraciones pendientes
+    # python migrations.py --check   -> además verifica con EXPLAIN que las consultas calientes usan índices
+    applied = asyncio.run(_migrate_standalone())
+    print(f"Migraciones aplicadas: {applied} (versión {LATEST_VERSION})")
+    if "--check" in sys.argv:
+        issues = check_indexes()
+        for issue in issues:
+            print(issue)
+        print("Índices OK" if not issues else f"{len(issues)} consultas sin índice")
+        sys.exit(1 if issues else 0)
@@ -0,0 +1,261 @@
+import asyncio
+import json
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import psycopg
+from fastapi.encoders import jsonable_encoder
+
+from db import dsn
+from metrics import STREAM_SUBSCRIBERS
+
+# Stream en vivo para admins (GET /ledger/stream, Server-Sent Events).
+# Los triggers de la migración 10 notifican nexus_ledger en cada INSERT al ledger y nexus_pending (id de la
+# factura) en cada cambio de estado. Una sola conexión LISTEN por réplica recibe los avisos, un despachador los
+# agrupa, lee una vez las filas nuevas y las reparte a todos los suscriptores: la base no ve una consulta por
+# cliente ni por aviso.
+#
+# Reanudación: cada bloque lleva "id: <ledger.id>"; al reconectar el cliente manda Last-Event-ID y recibe los
+# bloques que se perdió (hasta NEXUS_STREAM_BACKLOG_MAX; si son más, un evento "reset" para que recargue).
+# Un suscriptor lento que llena su cola descarta lo encolado y se pone al día leyendo desde la base.
+#
+# Huecos: con sub-cadenas (LEDGER_CHAINS>1) los ids se asignan antes del COMMIT y transacciones de cabezas
+# distintas commitean en cualquier orden; el id 100 puede aparecer después del 101. Solo se publica el prefijo
+# contiguo y lo de detrás de un hueco espera hasta NEXUS_STREAM_GAP_WAIT segundos a que se llene (un hueco
+# más viejo es un id que no se usó: rollback). Los clientes nunca reciben ni releen más allá de lo publicado.
+STREAM_QUEUE_SIZE = int(os.getenv("NEXUS_STREAM_QUEUE_SIZE", "5000"))
+STREAM_BACKLOG_MAX = int(os.getenv("NEXUS_STREAM_BACKLOG_MAX", "1000"))
+STREAM_KEEPALIVE = float(os.getenv("NEXUS_STREAM_KEEPALIVE", "15"))
+STREAM_GAP_WAIT = float(os.getenv("NEXUS_STREAM_GAP_WAIT", "2"))
+STREAM_GAP_POLL = 0.2  # relectura mientras hay bloques retenidos detrás de un hueco
+LEDGER_CHANNEL = "nexus_ledger"
+PENDING_CHANNEL = "nexus_pending"
+
+Frame = Tuple[Optional[int], str]  # (ledger.id del bloque o None, evento SSE ya serializado)
+LoadBlocks = Callable[[int, int], Awaitable[List[Dict[str, Any]]]]  # (after, limit) -> bloques
+LoadInvoices = Callable[[List[int]], Awaitable[List[Dict[str, Any]]]]  # ids -> facturas
+LoadHead = Callable[[], Awaitable[int]]  # último ledger.id hasta el que todos los bloques commitearon
+
+
+class Subscriber:
+    def __init__(self) -> None:
+        self.queue: "asyncio.Queue[Frame]" = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self.overflow = False
+
+
+_subscribers: Set[Subscriber] = set()
+_inbox: "Optional[asyncio.Queue[Tuple[str, str]]]" = None
+_tasks: List[asyncio.Task] = []
+_last_block_id: Optional[int] = None  # último bloque publicado
+_gap: Optional[Tuple[int, float]] = None  # (primer id faltante, cuándo se vio) del hueco que retiene bloques
+_load_blocks: Optional[LoadBlocks] = None
+_load_invoices: Optional[LoadInvoices] = None
+_load_head: Optional[LoadHead] = None
+
+
+def sse(event: str, data: Any, event_id: Optional[int] = None) -> str:
+    body = json.dumps(jsonable_encoder(data), ensure_ascii=False, separators=(",", ":"))
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {body}\n\n"
+
+
+def block_frame(block: Dict[str, Any]) -> Frame:
+    return int(block["id"]), sse("block", block, int(block["id"]))
+
+
+def publish(frame: Frame) -> None:
+    for sub in list(_subscribers):
+        if sub.overflow:
+            continue
+        try:
+            sub.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            sub.overflow = True
+
+
+# -----------------------------
+# Despacho (avisos -> filas -> suscriptores)
+# -----------------------------
+def _contiguous(blocks: List[Dict[str, Any]], after: int, now: float) -> int:
+    # cuántos bloques de `blocks` se pueden publicar: hasta el primer hueco que todavía no venció
+    global _gap
+    expected = after + 1
+    for i, b in enumerate(blocks):
+        block_id = int(b["id"])
+        if block_id != expected:
+            if _gap is None or _gap[0] != expected:
+                _gap = (expected, now)
+            if now - _gap[1] < STREAM_GAP_WAIT:
+                return i
+            _gap = None  # vencido: ids sin usar, se saltan
+        expected = block_id + 1
+    return len(blocks)
+
+
+async def _publish_blocks() -> bool:
+    # publica los bloques nuevos; True si quedaron bloques retenidos detrás de un hueco
+    global _last_block_id, _gap
+    seeding = _last_block_id is None
+    if seeding:
+        # por debajo de los appends en curso (con sub-cadenas pueden tener ids menores que bloques ya commiteados):
+        # el prefijo contiguo es anterior al stream y se saltea sin publicar; lo de detrás de un hueco sale
+        # por el camino de siempre cuando se llene
+        _last_block_id = await _load_head()  # type: ignore
+    while True:
+        blocks = await _load_blocks(_last_block_id, STREAM_BACKLOG_MAX)  # type: ignore
+        ready = _contiguous(blocks, _last_block_id, asyncio.get_running_loop().time())
+        if not seeding:
+            for b in blocks[:ready]:
+                publish(block_frame(b))
+        if ready:
+            _last_block_id = int(blocks[ready - 1]["id"])
+        if ready < len(blocks):
+            return True
+        _gap = None
+        if len(blocks) < STREAM_BACKLOG_MAX:
+            return False
+
+
+async def _publish_pending(ids: List[int]) -> None:
+    # la fila va completa si sigue pendiente (el cliente la agrega), si no solo id + estado (la quita)
+    rows = {int(r["id"]): r for r in await _load_invoices(ids)}  # type: ignore
+    for invoice_id in ids:
+        row = rows.get(invoice_id)
+        status = row["status"] if row else None
+        data = {"id": invoice_id, "status": status, "row": row if status == "PENDING_APPROVAL" else None}
+        publish((None, sse("pending", data)))
+
+
+async def _dispatch() -> None:
+    held = False
+    while True:
+        # lo acumulado mientras se consultaba la base sale en un solo lote; con bloques retenidos se relee
+        # aunque no llegue ningún aviso (el que llenó el hueco pudo avisar antes de que se leyera)
+        try:
+            batch = [await asyncio.wait_for(_inbox.get(), STREAM_GAP_POLL if held else None)]  # type: ignore
+        except asyncio.TimeoutError:
+            batch = [(LEDGER_CHANNEL, "")]
+        while not _inbox.empty():  # type: ignore
+            batch.append(_inbox.get_nowait())  # type: ignore
+        try:
+            if any(channel == LEDGER_CHANNEL for channel, _ in batch):
+                held = await _publish_blocks()
+            ids = sorted({int(p) for channel, p in batch if channel == PENDING_CHANNEL})
+            if ids:
+                await _publish_pending(ids)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # la base no respondió: el próximo aviso (o la reconexión) vuelve a leer desde _last_block_id
+            await asyncio.sleep(1.0)
+
+
+async def _listen() -> None:
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(dsn(), autocommit=True) as conn:
+                await conn.execute(f"LISTEN {LEDGER_CHANNEL};")
+                await conn.execute(f"LISTEN {PENDING_CHANNEL};")
+                # al (re)conectar pudo perderse algo: releer bloques desde el último publicado
+                _inbox.put_nowait((LEDGER_CHANNEL, ""))  # type: ignore
+                async for notify in conn.notifies():
+                    _inbox.put_nowait((notify.channel, notify.payload))  # type: ignore
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await asyncio.sleep(1.0)
+
+
+def start_stream(load_blocks: LoadBlocks, load_invoices: LoadInvoices, load_head: LoadHead) -> None:
+    global _inbox, _load_blocks, _load_invoices, _load_head
+    if _tasks:
+        return
+    _inbox = asyncio.Queue()
+    _load_blocks, _load_invoices, _load_head = load_blocks, load_invoices, load_head
+    loop = asyncio.get_running_loop()
+    _tasks.extend([loop.create_task(_listen()), loop.create_task(_dispatch())])
+
+
+async def stop_stream() -> None:
+    global _last_block_id, _gap
+    for task in _tasks:
+        task.cancel()
+    for task in _tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _tasks.clear()
+    _last_block_id = None
+    _gap = None
+
+
+# -----------------------------
+# Suscripción (un generador por cliente SSE)
+# -----------------------------
+async def catch_up(after: int, frames: List[str], upto: Optional[int]) -> Optional[int]:
+    # bloques desde la base después de `after` y hasta `upto` (lo ya publicado: lo retenido detrás de un hueco
+    # llega en vivo); None si son demasiados (el cliente debe recargar)
+    backlog = await _load_blocks(after, STREAM_BACKLOG_MAX + 1)  # type: ignore
+    if upto is not None:
+        backlog = [b for b in backlog if int(b["id"]) <= upto]
+    if len(backlog) > STREAM_BACKLOG_MAX:
+        return None
+    frames.extend(block_frame(b)[1] for b in backlog)
+    return int(backlog[-1]["id"]) if backlog else after
+
+
+async def events(resume_after: Optional[int]) -> AsyncIterator[str]:
+    sub = Subscriber()
+    _subscribers.add(sub)
+    STREAM_SUBSCRIBERS.inc()
+    # leído junto con la suscripción (sin await en medio): todo lo que llegue a la cola es posterior
+    last = _last_block_id
+    try:
+        yield "retry: 3000\n\n"
+        if resume_after is None:
+            # sin Last-Event-ID: solo lo nuevo; el id deja al cliente listo para reanudar
+            yield sse("hello", {"last_id": last}, last)
+        else:
+            # bloques perdidos desde Last-Event-ID; lo que llegue en vivo mientras tanto se descarta por id
+            frames: List[str] = []
+            caught = await catch_up(resume_after, frames, last)
+            if caught is None:
+                yield sse("reset", {"after": resume_after}, last)
+            else:
+                for frame in frames:
+                    yield frame
+                last = max(caught, last or 0) if frames else max(resume_after, last or 0)
+
+        while True:
+            if sub.overflow:
+                # cliente lento (o ráfaga mayor que la cola): se descarta la cola y se relee desde la base;
+                # los avisos de pendientes perdidos se reemplazan por un "reset" de la cola
+                while not sub.queue.empty():
+                    sub.queue.get_nowait()
+                sub.overflow = False
+                frames = []
+                caught = await catch_up(last or 0, frames, _last_block_id)
+                if caught is None:
+                    yield sse("reset", {"after": last}, last)
+                    return
+                for frame in frames:
+                    yield frame
+                last = caught
+                yield sse("pending_reset", {})
+                continue
+
+            try:
+                block_id, frame = await asyncio.wait_for(sub.queue.get(), STREAM_KEEPALIVE)
+            except asyncio.TimeoutError:
+                # comentario SSE: mantiene viva la conexión a través de proxies
+                yield ": keepalive\n\n"
+                continue
+            if block_id is not None and last is not None and block_id <= last:
+                continue
+            if block_id is not None:
+                last = block_id
+            yield frame
+    finally:
+        _subscribers.discard(sub)
+        STREAM_SUBSCRIBERS.dec()
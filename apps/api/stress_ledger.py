@@ -0,0 +1,142 @@
+import asyncio
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import psycopg
+
+from db import dsn
+from main import chain_start, ledger_chains, verify_blocks
+
+# Prueba de estrés de concurrencia: muchos appends en paralelo contra la API no deben bifurcar la cadena.
+# Carga (HTTP, como bench_batch.py): bodega ingresa lotes, oficina los factura y admin aprueba de a uno y en
+# batch intercalados (un batch toca varias cadenas), todo con STRESS_CONCURRENCY clientes a la vez. Una última
+# fase mezcla facturas nuevas y aprobaciones al mismo tiempo (las dos tocan los contadores de invoices e inventory).
+# En ambas, un orden de locks distinto entre los caminos termina en deadlock y 500. Después revisa directo en Postgres:
+#   - ninguna respuesta 5xx
+#   - verify_blocks pasa en cada cadena (enlaces y hashes desde su genesis o su último sello desacoplado)
+#   - ningún prev_hash se repite dentro de una cadena (dos appends sobre la misma cabeza = bifurcación)
+# Sale con código 1 si algo falla.
+#
+# Uso (API levantada y las variables DB_* de su misma base):
+#   API_URL=http://localhost:8000 STRESS_N=300 STRESS_CONCURRENCY=16 python stress_ledger.py
+
+api = os.getenv("API_URL", "http://localhost:8000").rstrip("/")
+n = int(os.getenv("STRESS_N", "300"))
+concurrency = int(os.getenv("STRESS_CONCURRENCY", "16"))
+batch_size = 10
+
+FORKS_SQL = """
+    SELECT chain, prev_hash, array_agg(id ORDER BY id)
+    FROM ledger
+    GROUP BY chain, prev_hash
+    HAVING COUNT(*) > 1
+    ORDER BY chain
+    LIMIT 10;
+"""
+
+
+def call(method: str, path: str, body=None, token: str = "") -> Tuple[int, object]:
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(f"{api}{path}", data=data, method=method)
+    req.add_header("Content-Type", "application/json")
+    if token:
+        req.add_header("Authorization", f"Bearer {token}")
+    try:
+        with urllib.request.urlopen(req) as res:
+            return res.status, json.loads(res.read() or b"null")
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code, None
+
+
+def login(username: str) -> str:
+    return call("POST", "/auth/login", {"username": username, "password": ""})[1]["token"]  # type: ignore
+
+
+def lot(i: int) -> dict:
+    # varias categorías: con LEDGER_CHAINS>1 la carga cae en varias sub-cadenas
+    return {"date": "2024-01-01", "item": f"Lote-STRESS-{i:06d}", "category": f"Cacao STRESS-{i % 8}", "type": "Entrada", "qty": 1}
+
+
+def run(label: str, jobs: List, codes: Dict[int, int]) -> List[object]:
+    # cada job es (method, path, body, token); devuelve los cuerpos en el mismo orden
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda job: call(*job), jobs))
+    phase: Dict[int, int] = {}
+    for code, _ in results:
+        phase[code] = phase.get(code, 0) + 1
+        codes[code] = codes.get(code, 0) + 1
+    print(f"  {label:<22} {len(jobs):>6}  {dict(sorted(phase.items()))}")
+    return [body for _, body in results]
+
+
+def invoice(lot_id: int, token: str) -> Tuple:
+    return ("POST", "/invoices", {"inventory_id": lot_id, "date": "2024-01-02", "client": "Stress", "total": 1.0}, token)
+
+
+def load() -> Dict[int, int]:
+    tokens = {u: login(u) for u in ("bodega", "oficina", "admin")}
+    codes: Dict[int, int] = {}
+
+    lots = run("POST /inventory", [("POST", "/inventory", lot(i), tokens["bodega"]) for i in range(n)], codes)
+    lot_ids = [b["id"] for b in lots if b]  # type: ignore
+    invoices = run("POST /invoices", [invoice(i, tokens["oficina"]) for i in lot_ids], codes)
+    invoice_ids = [b["id"] for b in invoices if b]  # type: ignore
+
+    # mitad de a uno (cada una dos veces: la segunda compite y debe dar 409), mitad en batches, intercalados: un
+    # batch toca varias cadenas a la vez que las aprobaciones sueltas (mismo orden de locks o deadlock y 500)
+    approvals = []
+    for k in range(0, len(invoice_ids), 2 * batch_size):
+        chunk = invoice_ids[k:k + 2 * batch_size]
+        approvals.append(("POST", "/admin/invoices/approve-batch", {"invoice_ids": chunk[:batch_size]}, tokens["admin"]))
+        single = [("POST", f"/admin/invoices/{i}/approve", None, tokens["admin"]) for i in chunk[batch_size:]]
+        approvals += single + single
+    run("approve + batch", approvals, codes)
+
+    # mixta: la mitad de los lotes nuevos ya facturados se aprueba mientras la otra mitad se factura
+    lots = run("POST /inventory", [("POST", "/inventory", lot(n + i), tokens["bodega"]) for i in range(n)], codes)
+    lot_ids = [b["id"] for b in lots if b]  # type: ignore
+    half = len(lot_ids) // 2
+    pending = run("POST /invoices", [invoice(i, tokens["oficina"]) for i in lot_ids[:half]], codes)
+    approvals = [("POST", f"/admin/invoices/{b['id']}/approve", None, tokens["admin"]) for b in pending if b]  # type: ignore
+    creates = [invoice(i, tokens["oficina"]) for i in lot_ids[half:]]
+    mixed = [job for pair in zip(approvals, creates) for job in pair]
+    run("invoices + approve", mixed, codes)
+    return codes
+
+
+async def check() -> List[str]:
+    errors: List[str] = []
+    async with await psycopg.AsyncConnection.connect(dsn()) as conn:
+        async with conn.cursor() as cur:
+            for chain in await ledger_chains(cur):
+                res = await verify_blocks(cur, chain=chain, prev_hash=await chain_start(cur, chain))
+                print(f"  cadena {chain}: {res.checked} bloques, ok={res.ok}")
+                if not res.ok:
+                    errors.append(f"cadena {chain}: bloque inválido id={res.failed_id}")
+            await cur.execute(FORKS_SQL)
+            for chain, prev_hash, ids in await cur.fetchall():
+                errors.append(f"cadena {chain}: bifurcación, bloques {ids} enlazan con {bytes(prev_hash).hex()}")
+    return errors
+
+
+def main() -> None:
+    print(f"{n} lotes, {concurrency} clientes concurrentes")
+    codes = load()
+    errors = [f"{count} respuestas {code}" for code, count in codes.items() if code >= 500]
+    errors += asyncio.run(check())
+    if errors:
+        print("FALLÓ:")
+        for e in errors:
+            print(f"  {e}")
+        sys.exit(1)
+    print("OK: sin 5xx, cadenas íntegras y sin bifurcaciones")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,14 @@
 // Cliente de API (mock vs real)
 window.api = (function () {
   const cfg = window.APP_CONFIG || { API_BASE: "/api", USE_MOCK: true };
+  const PAGE_SIZE = cfg.PAGE_SIZE || 200;
+  const MAX_PAGE_SIZE = 1000;
 
   function token() {
     return localStorage.getItem(state.tokenKey) || "";
   }
 
-  async function request(path, { method = "GET", body = null, auth = true } = {}) {
+  async function request(path, { method = "GET", body = null, auth = true, withHeaders = false } = {}) {
     const headers = {};
 
     if (body !== null) headers["Content-Type"] = "application/json";
@@ -42,7 +44,99 @@ window.api = (function () {
       throw new Error(msg);
     }
 
-    return data;
+    return withHeaders ? { data, headers: res.headers } : data;
+  }
+
+  // format=columnar: {columns, rows: [[...]]} (nombres una sola vez); se arma un objeto por fila para las vistas
+  function fromColumnar(data) {
+    if (!data || !Array.isArray(data.columns)) return data || [];
+    const cols = data.columns;
+    return data.rows.map((r) => {
+      const o = {};
+      for (let i = 0; i < cols.length; i++) o[cols[i]] = r[i];
+      return o;
+    });
+  }
+
+  // Listas paginadas por keyset: la API devuelve X-Next-After mientras haya más filas
+  async function requestPage(path, { after = null, limit = PAGE_SIZE } = {}) {
+    const sep = path.includes("?") ? "&" : "?";
+    const q = `${sep}format=columnar&limit=${limit}` + (after !== null && after !== undefined ? `&after=${after}` : "");
+    const { data, headers } = await request(`${path}${q}`, { withHeaders: true });
+    return { rows: fromColumnar(data), next: headers.get("X-Next-After") };
+  }
+
+  async function requestAll(path) {
+    let out = [];
+    let after = null;
+    do {
+      const page = await requestPage(path, { after, limit: MAX_PAGE_SIZE });
+      out = out.concat(page.rows);
+      after = page.next;
+    } while (after);
+    return out;
+  }
+
+  // Server-Sent Events sobre fetch (EventSource no permite el header Authorization).
+  // Reconecta solo y reanuda con Last-Event-ID; close() corta la conexión y los reintentos.
+  function openStream(path, onEvent) {
+    let lastId = null;
+    let closed = false;
+    let ctrl = null;
+    let retryMs = 3000;
+
+    function dispatch(raw) {
+      const ev = { event: "message", data: "", id: null };
+      for (const line of raw.split("\n")) {
+        if (!line || line.startsWith(":")) continue;
+        const i = line.indexOf(":");
+        const key = i < 0 ? line : line.slice(0, i);
+        const value = i < 0 ? "" : line.slice(i + 1).replace(/^ /, "");
+        if (key === "event") ev.event = value;
+        else if (key === "data") ev.data += value;
+        else if (key === "id") ev.id = value;
+        else if (key === "retry" && /^\d+$/.test(value)) retryMs = Number(value);
+      }
+      if (ev.id !== null) lastId = ev.id;
+      if (ev.data) onEvent(ev.event, JSON.parse(ev.data));
+    }
+
+    (async function run() {
+      while (!closed) {
+        ctrl = new AbortController();
+        try {
+          const headers = { Authorization: `Bearer ${token()}` };
+          if (lastId !== null) headers["Last-Event-ID"] = lastId;
+          const res = await fetch(`${cfg.API_BASE}${path}`, { headers, signal: ctrl.signal });
+          // sesión vencida o sin permiso: no insistir
+          if (res.status === 401 || res.status === 403) break;
+          if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+
+          const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+          let buf = "";
+          for (;;) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buf += value;
+            let sep;
+            while ((sep = buf.indexOf("\n\n")) >= 0) {
+              dispatch(buf.slice(0, sep));
+              buf = buf.slice(sep + 2);
+            }
+          }
+        } catch (e) {
+          if (closed) break;
+        }
+        if (!closed) await new Promise((r) => setTimeout(r, retryMs));
+      }
+    })();
+
+    return {
+      close() {
+        closed = true;
+        ctrl?.abort();
+      },
+    };
   }
 
   function mockLogin(username) {
@@ -77,12 +171,37 @@ window.api = (function () {
       return await request("/auth/login", { method: "POST", body: { username, password }, auth: false });
     },
 
+    async logout() {
+      if (cfg.USE_MOCK) return { ok: true };
+      return await request("/auth/logout", { method: "POST" });
+    },
+
+    // -----------------------------
+    // DASHBOARD: CONTADORES (costo constante en la API)
+    // -----------------------------
+    async getStats() {
+      if (cfg.USE_MOCK) {
+        const bucket = (rows, key, amount) => {
+          const sel = rows.filter((x) => x.status === key);
+          return { count: sel.length, amount: sel.reduce((acc, x) => acc + Number(x[amount] || 0), 0) };
+        };
+        const inv = mockInventory();
+        const invc = mockInvoices();
+        return {
+          lots: Object.fromEntries(["AVAILABLE", "RESERVED", "SOLD"].map((k) => [k, bucket(inv, k, "qty")])),
+          invoices: Object.fromEntries(["PENDING_APPROVAL", "APPROVED", "REJECTED"].map((k) => [k, bucket(invc, k, "total")])),
+          ledger_blocks: (state?.data?.ledger || []).length,
+        };
+      }
+      return await request("/stats");
+    },
+
     // -----------------------------
     // BODEGA: LOTES
     // -----------------------------
     async getInventory() {
       if (cfg.USE_MOCK) return mockInventory().filter((x) => (x.status || "AVAILABLE") === "AVAILABLE");
-      return await request("/inventory");
+      return await requestAll("/inventory");
     },
 
     // payload esperado: {date,item,category,qty}
@@ -96,12 +215,12 @@ window.api = (function () {
     // -----------------------------
     async getAvailableLots() {
       if (cfg.USE_MOCK) return mockInventory().filter((x) => (x.status || "AVAILABLE") === "AVAILABLE");
-      return await request("/lots/available");
+      return await requestAll("/lots/available");
     },
 
     async getInvoices() {
       if (cfg.USE_MOCK) return mockInvoices();
-      return await request("/invoices");
+      return await requestAll("/invoices");
     },
 
     // payload esperado: {inventory_id,date,client,total}
@@ -115,7 +234,7 @@ window.api = (function () {
     // -----------------------------
     async getPendingApprovals() {
       if (cfg.USE_MOCK) return mockInvoices().filter((x) => (x.status || "PENDING_APPROVAL") === "PENDING_APPROVAL");
-      return await request("/admin/pending");
+      return fromColumnar(await request("/admin/pending?format=columnar"));
     },
 
     async approveInvoice(id) {
@@ -133,12 +252,36 @@ window.api = (function () {
     // -----------------------------
     async getLedger() {
       if (cfg.USE_MOCK) return state?.data?.ledger || [];
-      return await request("/ledger");
+      return await requestAll("/ledger");
+    },
+
+    // {rows, next}: next = cursor para la siguiente página (null si no hay más)
+    async getLedgerPage(after = null) {
+      if (cfg.USE_MOCK) return { rows: state?.data?.ledger || [], next: null };
+      return await requestPage("/ledger", { after });
+    },
+
+    async getLedgerProof(txId) {
+      if (cfg.USE_MOCK) return null;
+      return await request(`/ledger/proof/${encodeURIComponent(txId)}`);
+    },
+
+    // eventos: block (bloque nuevo), pending (cambio en la cola de aprobación), pending_reset, hello, reset
+    streamLedger(onEvent) {
+      if (cfg.USE_MOCK) return { close() {} };
+      return openStream("/ledger/stream", onEvent);
+    },
+
+    // verificación en segundo plano: devuelve el job al instante (o el que ya estaba en curso)
+    async startVerifyJob() {
+      if (cfg.USE_MOCK) return { job_id: "mock", status: "done", ok: true, message: "Integridad OK (mock)" };
+      return await request("/ledger/verify/jobs", { method: "POST" });
     },
 
-    async verifyChain() {
-      if (cfg.USE_MOCK) return { ok: true, message: "Integridad OK (mock)" };
-      return await request("/ledger/verify");
+    // {status: running|done|error, checked, total, eta_seconds, failed_id, ...}
+    async getVerifyJob(id) {
+      if (cfg.USE_MOCK) return { job_id: id, status: "done", ok: true, message: "Integridad OK (mock)" };
+      return await request(`/ledger/verify/jobs/${encodeURIComponent(id)}`);
     },
   };
 })();
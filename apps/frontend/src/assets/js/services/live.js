@@ -0,0 +1,16 @@
+// Stream en vivo del ledger (solo admin): una conexión para toda la sesión; cada vista registra su handler en bind()
+window.live = {
+  handle: null,
+  onEvent: null,
+
+  start(onEvent) {
+    this.onEvent = onEvent;
+    if (!this.handle) this.handle = api.streamLedger((event, data) => this.onEvent && this.onEvent(event, data));
+  },
+
+  stop() {
+    this.handle?.close();
+    this.handle = null;
+    this.onEvent = null;
+  },
+};
@@ -76,6 +76,7 @@ window.session = {
   },
 
   clear() {
+    window.live?.stop();
     localStorage.removeItem(state.roleKey);
     localStorage.removeItem(state.tokenKey);
     state.currentUser = null;
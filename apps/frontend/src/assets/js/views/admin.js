@@ -13,6 +13,8 @@ window.format = window.format || {
 };
 
 window.views.admin = {
+  refresh: null,
+
   async render() {
     const rows = await api.getPendingApprovals();
 
@@ -108,6 +110,14 @@ window.views.admin = {
   },
 
   bind() {
+    // Cola en vivo (SSE): se vuelve a pintar solo cuando cambia, sin polling
+    live.start((event, data) => {
+      if (event !== "pending" && event !== "pending_reset") return;
+      if (event === "pending" && data.status === "PENDING_APPROVAL") toast.show(`Nueva factura pendiente #${data.id}`, "info");
+      clearTimeout(this.refresh);
+      this.refresh = setTimeout(() => state.activeView === "admin" && window.appRender(), 300);
+    });
+
     // Ir a ledger
     $("#btnGoLedger")?.addEventListener("click", () => {
       state.activeView = "ledger";
@@ -14,6 +14,28 @@ const cacaoIcon = (className = "w-5 h-5") => `
 `;
 
 views.dashboard = {
+  statsHtml(stats) {
+    if (!stats) return "";
+    const card = (label, value, sub = "") => `
+      <div class="bg-white border border-slate-200 rounded-xl p-4 shadow-sm">
+        <p class="text-xs font-semibold text-slate-500 uppercase tracking-wider">${label}</p>
+        <p class="text-2xl font-bold text-slate-900 mt-1">${value}</p>
+        ${sub ? `<p class="text-xs text-slate-500 mt-1">${sub}</p>` : ""}
+      </div>
+    `;
+    const money = (v) => (window.format?.moneyUSD ? format.moneyUSD(v) : v);
+    return `
+      <div class="grid grid-cols-2 lg:grid-cols-6 gap-3 mb-8">
+        ${card("Lotes disponibles", stats.lots.AVAILABLE.count, `Cant: ${stats.lots.AVAILABLE.amount}`)}
+        ${card("Lotes reservados", stats.lots.RESERVED.count, `Cant: ${stats.lots.RESERVED.amount}`)}
+        ${card("Lotes vendidos", stats.lots.SOLD.count, `Cant: ${stats.lots.SOLD.amount}`)}
+        ${card("Facturas pendientes", stats.invoices.PENDING_APPROVAL.count, money(stats.invoices.PENDING_APPROVAL.amount))}
+        ${card("Facturas aprobadas", stats.invoices.APPROVED.count, money(stats.invoices.APPROVED.amount))}
+        ${card("Bloques ledger", stats.ledger_blocks)}
+      </div>
+    `;
+  },
+
   async render() {
     const user = state.currentUser;
 
@@ -83,6 +105,8 @@ views.dashboard = {
       }
     }
 
+    // contadores del servidor (no dependen del volumen); si fallan, la vista sigue sin ellos
+    const stats = await api.getStats().catch(() => null);
     const initial = (user?.name || "?").charAt(0);
 
     return `
@@ -131,6 +155,7 @@ views.dashboard = {
 
           <div class="flex-1 overflow-auto p-4 md:p-8">
             <div class="max-w-7xl mx-auto fade-in">
+              ${this.statsHtml(stats)}
               ${content}
             </div>
           </div>
@@ -141,6 +166,8 @@ views.dashboard = {
 
   bind() {
     const logout = () => {
+      // revoca el token en la API (best effort); la sesión local se limpia igual
+      api.logout().catch(() => {});
       session.clear();
       toast.show("Sesión cerrada", "info");
       window.appRender();
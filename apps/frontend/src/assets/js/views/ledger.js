@@ -1,8 +1,81 @@
 window.views = window.views || {};
 
+// Verificación local de pruebas Merkle (RFC 6962): hoja = H(0x00 || hash), nodo = H(0x01 || izq || der)
+window.merkle = {
+  hexToBytes(hex) {
+    const out = new Uint8Array(hex.length / 2);
+    for (let i = 0; i < out.length; i++) out[i] = parseInt(hex.substr(i * 2, 2), 16);
+    return out;
+  },
+
+  async sha256Hex(bytes) {
+    const d = await crypto.subtle.digest("SHA-256", bytes);
+    return [...new Uint8Array(d)].map((b) => b.toString(16).padStart(2, "0")).join("");
+  },
+
+  async leaf(blockHash) {
+    const data = new TextEncoder().encode(blockHash);
+    const buf = new Uint8Array(data.length + 1);
+    buf.set(data, 1);
+    return await this.sha256Hex(buf);
+  },
+
+  async node(left, right) {
+    const l = this.hexToBytes(left);
+    const r = this.hexToBytes(right);
+    const buf = new Uint8Array(1 + l.length + r.length);
+    buf[0] = 1;
+    buf.set(l, 1);
+    buf.set(r, 1 + l.length);
+    return await this.sha256Hex(buf);
+  },
+
+  async verify(p) {
+    let acc = await this.leaf(p.block_hash);
+    for (const step of p.proof) {
+      acc = step.side === "left" ? await this.node(step.hash, acc) : await this.node(acc, step.hash);
+    }
+    return acc === p.root;
+  }
+};
+
 views.ledger = {
+  next: null,
+  count: 0,
+  lastId: 0,
+
+  rowHtml(r) {
+    return `
+    <tr class="hover:bg-slate-800/30 transition-colors">
+      <td class="p-4 text-emerald-400 whitespace-nowrap">${r.timestamp}</td>
+      <td class="p-4 text-yellow-200">${r.actor}</td>
+      <td class="p-4 font-bold text-white">${r.action}</td>
+      <td class="p-4"><span class="opacity-50">${r.tx_id}</span>${r.chain ? ` <span class="text-xs text-purple-300" title="Sub-cadena">#${r.chain}</span>` : ""}</td>
+      <td class="p-4 opacity-50 truncate max-w-[120px]" title="${r.prev_hash}">${r.prev_hash}</td>
+      <td class="p-4 text-blue-300 truncate max-w-[160px]" title="${r.hash}">${r.hash}</td>
+      <td class="p-4">
+        <button class="proof-btn text-slate-400 hover:text-emerald-400 transition" data-tx="${r.tx_id}" title="Verificar inclusión (Merkle)">
+          <i data-lucide="fingerprint" class="w-4 h-4"></i>
+        </button>
+      </td>
+    </tr>
+    `;
+  },
+
+  footerHtml() {
+    return this.next
+      ? `${this.count} BLOCKS •
+         <button id="ledger-more" class="text-slate-400 hover:text-white underline">CARGAR MÁS</button>`
+      : `END OF LEDGER • ${this.count} BLOCKS`;
+  },
+
   async render() {
-    const rows = await api.getLedger();
+    // primera página; el resto se pide bajo demanda (keyset ?after=)
+    const page = await api.getLedgerPage();
+    const rows = page.rows;
+    this.next = page.next;
+    this.count = rows.length;
+    this.lastId = rows.length ? rows[rows.length - 1].id : 0;
     return `
       <div class="flex flex-col md:flex-row md:items-center justify-between gap-4 mb-8">
         <div>
@@ -39,31 +112,34 @@ views.ledger = {
                 <th class="p-4 font-normal">Tx_ID</th>
                 <th class="p-4 font-normal">Prev_Hash</th>
                 <th class="p-4 font-normal">Current_Hash</th>
+                <th class="p-4 font-normal">Proof</th>
               </tr>
             </thead>
-            <tbody class="divide-y divide-slate-800/50">
-              ${rows.map(r => `
-                <tr class="hover:bg-slate-800/30 transition-colors">
-                  <td class="p-4 text-emerald-400 whitespace-nowrap">${r.timestamp}</td>
-                  <td class="p-4 text-yellow-200">${r.actor}</td>
-                  <td class="p-4 font-bold text-white">${r.action}</td>
-                  <td class="p-4 opacity-50">${r.tx_id}</td>
-                  <td class="p-4 opacity-50 truncate max-w-[120px]" title="${r.prev_hash}">${r.prev_hash}</td>
-                  <td class="p-4 text-blue-300 truncate max-w-[160px]" title="${r.hash}">${r.hash}</td>
-                </tr>
-              `).join('')}
+            <tbody id="ledger-rows" class="divide-y divide-slate-800/50">
+              ${rows.map((r) => this.rowHtml(r)).join('')}
             </tbody>
           </table>
         </div>
 
-        <div class="p-3 bg-slate-950 text-center text-slate-600 text-[10px]">
-          END OF LEDGER • ${rows.length} BLOCKS
+        <div id="ledger-footer" class="p-3 bg-slate-950 text-center text-slate-600 text-[10px]">
+          ${this.footerHtml()}
         </div>
       </div>
     `;
   },
 
   bind() {
+    // bloques nuevos en vivo (SSE): solo se agregan si ya se cargó hasta el final; si no, llegan con "cargar más"
+    live.start((event, data) => {
+      if (event === "reset") return window.appRender();
+      if (event !== "block" || this.next || data.id <= this.lastId || !$("#ledger-rows")) return;
+      $("#ledger-rows").insertAdjacentHTML("beforeend", this.rowHtml(data));
+      this.count += 1;
+      this.lastId = data.id;
+      dom.setHTML("#ledger-footer", this.footerHtml());
+      lucide.createIcons();
+    });
+
     $("#verify-btn")?.addEventListener("click", async () => {
       const btn = $("#verify-btn");
       const original = btn.innerHTML;
@@ -73,8 +149,19 @@ views.ledger = {
       btn.classList.add("opacity-75", "cursor-not-allowed");
 
       try {
-        const res = await api.verifyChain();
-        toast.show(res.message || (res.ok ? "Cadena OK" : "Cadena con errores"), res.ok ? "success" : "error");
+        // el job corre en la API; se consulta su avance hasta que termina
+        let res = await api.startVerifyJob();
+        while (res.status === "running") {
+          const pct = res.total ? ` ${Math.floor((100 * res.checked) / res.total)}%` : "";
+          const eta = res.eta_seconds != null ? ` · ETA ${Math.ceil(res.eta_seconds)}s` : "";
+          btn.innerHTML = `<i data-lucide="loader" class="w-4 h-4 animate-spin"></i> VERIFICANDO...${pct}${eta}`;
+          lucide.createIcons();
+          await new Promise((r) => setTimeout(r, 1000));
+          res = await api.getVerifyJob(res.job_id);
+        }
+        if (res.status === "error") throw new Error(res.error || res.message);
+        const failed = res.failed_id != null ? ` (bloque #${res.failed_id})` : "";
+        toast.show((res.message || (res.ok ? "Cadena OK" : "Cadena con errores")) + failed, res.ok ? "success" : "error");
       } catch (e) {
         toast.show(e.message || "Error al verificar", "error");
       } finally {
@@ -83,6 +170,42 @@ views.ledger = {
         lucide.createIcons();
       }
     });
+
+    // delegación: también cubre filas agregadas con "cargar más"
+    $("#ledger-rows")?.addEventListener("click", async (ev) => {
+      const btn = ev.target.closest(".proof-btn");
+      if (!btn) return;
+      const txId = btn.dataset.tx;
+      try {
+        if (!window.crypto?.subtle) throw new Error("El navegador no permite SHA-256 local (requiere HTTPS)");
+        const p = await api.getLedgerProof(txId);
+        if (!p) return toast.show("Pruebas Merkle no disponibles en modo mock", "info");
+        const ok = await merkle.verify(p);
+        toast.show(
+          ok
+            ? `${txId}: incluido en segmento #${p.segment} (${p.proof.length} pasos)`
+            : `${txId}: la prueba NO coincide con la raíz del segmento`,
+          ok ? "success" : "error"
+        );
+      } catch (e) {
+        toast.show(e.message || "Error al obtener la prueba", "error");
+      }
+    });
+
+    $("#ledger-footer")?.addEventListener("click", async (ev) => {
+      if (!ev.target.closest("#ledger-more") || !this.next) return;
+      try {
+        const page = await api.getLedgerPage(this.next);
+        $("#ledger-rows").insertAdjacentHTML("beforeend", page.rows.map((r) => this.rowHtml(r)).join(""));
+        this.next = page.next;
+        this.count += page.rows.length;
+        if (page.rows.length) this.lastId = page.rows[page.rows.length - 1].id;
+        dom.setHTML("#ledger-footer", this.footerHtml());
+        lucide.createIcons();
+      } catch (e) {
+        toast.show(e.message || "Error al cargar bloques", "error");
+      }
+    });
   }
 };
 